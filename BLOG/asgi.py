@@ -13,4 +13,11 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'BLOG.settings')
 
-application = get_asgi_application()
+# Асинхронные представления (оформление заказа, уведомления ЮKassa) ждут внешние
+# сервисы, не занимая поток, только при запуске через ASGI-сервер (uvicorn/daphne)
+django_application = get_asgi_application()
+
+# Поток событий личных сообщений (/messages/stream) обслуживается до Django
+from app.realtime import RealtimeMiddleware  # noqa: E402
+
+application = RealtimeMiddleware(django_application)
@@ -26,6 +26,8 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = config.SECRET_KEY
 YOOKASSA_SHOP_ID = config.SHOP_ID
 YOOKASSA_SECRET_KEY = config.SECRET_KEY
+# Адрес API ЮKassa; для разработки и тестов - локальная заглушка (manage.py run_fake_yookassa)
+YOOKASSA_API_URL = 'https://api.yookassa.ru/v3'
 
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
@@ -46,6 +48,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Первым, чтобы в замер попали запросы сессий и аутентификации (app/profiling.py)
+    'app.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -59,7 +63,8 @@ ROOT_URLCONF = 'BLOG.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates с замером времени рендера для профилирования
+        'BACKEND': 'app.profiling.ProfiledTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'templates')],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -87,6 +92,31 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Алиас кеша для счётчика непрочитанных сообщений
+UNREAD_COUNT_CACHE = 'default'
+
+# Брокер событий для личных сообщений в реальном времени (app/realtime.py).
+# InProcessBroker работает в пределах одного процесса ASGI-сервера
+REALTIME_BACKEND = 'app.realtime.InProcessBroker'
+
+# Отложенная запись лайков (app/like_buffer.py): лайки копятся в журнале процесса
+# в LIKE_BUFFER_DIR и пишутся в БД пачками. Требует fcntl (Linux/macOS)
+LIKE_WRITE_BEHIND = False
+LIKE_BUFFER_DIR = BASE_DIR / 'like_buffer'
+
+# Профилирование запросов: заголовок Server-Timing и статистика /profiling/stats
+PROFILING_ENABLED = DEBUG
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -128,6 +158,9 @@ STATICFILES_DIRS = [
 ]
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Предел размера каталога миниатюр media/thumbs (см. app/thumbnails.py)
+THUMBNAIL_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
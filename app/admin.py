@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Post, Product, Category, ProductImage
+from .models import Post, Product, Category, ProductImage, Job
+from .search import search_documents
 from PIL import Image
 
 # Register your models here.
@@ -26,4 +27,17 @@ class ProductAdmin(admin.ModelAdmin):
     list_display = ['name', 'category', 'price', 'created_at']
     list_filter = ['category', 'created_at']
     search_fields = ['name', 'description']
-    inlines = [ProductImageInline]
\ No newline at end of file
+    inlines = [ProductImageInline]
+    search_results_limit = 1000
+
+    # Поиск через полнотекстовый индекс вместо LIKE '%...%' по name/description
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        hits = search_documents(search_term, kind='product', limit=self.search_results_limit)
+        return queryset.filter(pk__in=[hit.object_id for hit in hits]), False
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'kind', 'status', 'attempts', 'created_at', 'finished_at']
+    list_filter = ['kind', 'status']
@@ -0,0 +1,280 @@
+import io
+import json
+import platform
+import random
+import time
+import tracemalloc
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.test import Client
+from django.urls import URLPattern, reverse
+from PIL import Image
+
+from .models import (Post, Like, Comment, CommentLike, UserProfile, Favorite, Follow, Message, Conversation,
+                     Category, Product, ProductImage, TrendingBucket)
+from .profiling import RequestProfile, percentile
+from .timeline import fan_out
+from .trending import TRENDING_BUCKET, bucket_start
+
+# Нагрузочный прогон представлений на синтетических данных (команда benchmark).
+# Данные создаются bulk_create'ом, поэтому сигналы не срабатывают - счётчики, пути
+# комментариев, сводки переписок и поисковый индекс после генерации достраиваются
+# штатными командами rebuild_*/recount_counters.
+
+DEFAULT_DATASET = {
+    'users': 50,
+    'posts': 500,
+    'likes_per_post': 10,
+    'comments_per_post': 20,
+    'comment_depth': 4,
+    'favorites_per_user': 20,
+    'follows_per_user': 10,
+    'messages': 2000,
+    'categories': 8,
+    'products': 200,
+    'images': 8,
+}
+
+# Представления с побочными эффектами или внешними вызовами не прогоняются
+SKIP_URLS = {'logout', 'del_post', 'toggle_like', 'toggle_favorite', 'toggle_follow', 'add_comment', 'send_message',
+             'mark_messages_read', 'mark_all_messages_read', 'conversation_messages', 'message_stream',
+             'shop_checkout', 'yookassa_webhook', 'thumbnail', 'profiling_stats'}
+
+BENCHMARK_PASSWORD = 'benchmark'
+
+
+def _image_content(index, size=(800, 600)):
+    color = ((index * 53) % 256, (index * 97) % 256, (index * 151) % 256)
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'JPEG', quality=85)
+    return ContentFile(buffer.getvalue())
+
+
+def generate_dataset(options, seed=0, batch_size=1000):
+    rng = random.Random(seed)
+    # Несколько файлов на всех: ссылки из разных записей на одно изображение
+    images = [default_storage.save(f'benchmark/image_{index}.jpg', _image_content(index))
+              for index in range(options['images'])]
+
+    password = make_password(BENCHMARK_PASSWORD)
+    users = User.objects.bulk_create(
+        [User(username=f'bench{index}', email=f'bench{index}@example.com', password=password)
+         for index in range(options['users'])],
+        batch_size=batch_size,
+    )
+    UserProfile.objects.bulk_create(
+        [UserProfile(user=user, avatar=rng.choice(images) if index % 2 else None)
+         for index, user in enumerate(users)],
+        batch_size=batch_size,
+    )
+
+    posts = Post.objects.bulk_create(
+        [Post(author=rng.choice(users), title=f'Пост {index}',
+              content=' '.join(rng.choice(WORDS) for _ in range(rng.randint(20, 120))),
+              image=rng.choice(images) if index % 3 == 0 else None)
+         for index in range(options['posts'])],
+        batch_size=batch_size,
+    )
+
+    likes_per_post = min(options['likes_per_post'], len(users))
+    Like.objects.bulk_create(
+        [Like(user=user, post=post) for post in posts for user in rng.sample(users, likes_per_post)],
+        batch_size=batch_size,
+    )
+    favorites_per_user = min(options['favorites_per_user'], len(posts))
+    Favorite.objects.bulk_create(
+        [Favorite(user=user, post=post) for user in users for post in rng.sample(posts, favorites_per_user)],
+        batch_size=batch_size,
+    )
+
+    follows_per_user = min(options['follows_per_user'], len(users) - 1)
+    Follow.objects.bulk_create(
+        [Follow(follower=user, author=author) for user in users
+         for author in rng.sample([other for other in users if other != user], follows_per_user)],
+        batch_size=batch_size,
+    )
+
+    # Комментарии по уровням: ответы ссылаются на комментарии предыдущего уровня того же поста
+    per_level = max(1, options['comments_per_post'] // (options['comment_depth'] + 1))
+    comments = []
+    level = [None] * len(posts)
+    for depth in range(options['comment_depth'] + 1):
+        batch = []
+        for post, parents in zip(posts, level):
+            for _ in range(per_level):
+                parent = rng.choice(parents) if parents else None
+                batch.append(Comment(post=post, author=rng.choice(users), parent=parent,
+                                     content=' '.join(rng.choice(WORDS) for _ in range(rng.randint(5, 40)))))
+        created = Comment.objects.bulk_create(batch, batch_size=batch_size)
+        comments.extend(created)
+        by_post = {}
+        for comment in created:
+            by_post.setdefault(comment.post_id, []).append(comment)
+        level = [by_post.get(post.id) for post in posts]
+    CommentLike.objects.bulk_create(
+        [CommentLike(user=rng.choice(users), comment=comment) for comment in comments[::3]],
+        batch_size=batch_size, ignore_conflicts=True,
+    )
+
+    messages = []
+    for index in range(options['messages']):
+        sender, recipient = rng.sample(users, 2)
+        messages.append(Message(sender=sender, recipient=recipient, content=f'Сообщение {index}'))
+    Message.objects.bulk_create(messages, batch_size=batch_size)
+
+    categories = Category.objects.bulk_create(
+        [Category(name=f'Категория {index}') for index in range(options['categories'])],
+    )
+    products = Product.objects.bulk_create(
+        [Product(name=f'Товар {index}', category=rng.choice(categories), price=rng.randint(100, 10000),
+                 description=' '.join(rng.choice(WORDS) for _ in range(30)))
+         for index in range(options['products'])],
+        batch_size=batch_size,
+    )
+    ProductImage.objects.bulk_create(
+        [ProductImage(product=product, image=rng.choice(images), is_primary=order == 0, order=order)
+         for product in products for order in range(2)],
+        batch_size=batch_size,
+    )
+
+    for command in ('rebuild_comment_paths', 'recount_counters', 'rebuild_conversations', 'rebuild_search_index'):
+        call_command(command, stdout=io.StringIO())
+    # Ленты подписчиков - тем же обработчиком, что и фоновая задача после публикации
+    for post in posts:
+        fan_out(post.id)
+
+    # Активность за последние сутки для страницы "Популярное"
+    now = bucket_start()
+    TrendingBucket.objects.bulk_create(
+        [TrendingBucket(post=post, bucket=now - TRENDING_BUCKET * hour, points=rng.randint(1, 20))
+         for post in rng.sample(posts, len(posts) // 5) for hour in rng.sample(range(24), 3)],
+        batch_size=batch_size,
+    )
+
+    # Большая часть переписок прочитана до последнего сообщения
+    read = [pk for pk in Conversation.objects.order_by('pk').values_list('pk', flat=True) if rng.random() < 0.7]
+    for start in range(0, len(read), batch_size):
+        Conversation.objects.filter(pk__in=read[start:start + batch_size]).update(
+            last_read_id=F('last_message_id'), unread_count=0)
+    return users
+
+
+def sample_kwargs(user):
+    # Значения параметров URL: берутся записи, на которых страница не пустая
+    post = Post.objects.filter(comment_count__gt=0).order_by('-comment_count').first()
+    comment = Comment.objects.filter(post=post, depth=0).order_by('path').first()
+    contact = Message.objects.filter(recipient=user).values_list('sender_id', flat=True).first()
+    product = Product.objects.first()
+    return {
+        'post_id': post.id,
+        'comment_id': comment.id,
+        'recipient_id': contact or user.id,
+        'username': user.username,
+        'category_id': product.category_id,
+        'product_id': product.id,
+    }
+
+
+def benchmark_urls(urlpatterns, kwargs):
+    for pattern in urlpatterns:
+        if not isinstance(pattern, URLPattern) or pattern.name in SKIP_URLS:
+            continue
+        names = pattern.pattern.converters.keys() if hasattr(pattern.pattern, 'converters') else ()
+        url = reverse(pattern.name, kwargs={name: kwargs[name] for name in names})
+        yield f'{pattern.name} {pattern.pattern}', url
+
+
+def measure(client, url, iterations):
+    client.get(url)  # прогрев: кеши фрагментов, шаблоны
+    timings = []
+    status = None
+    start = time.perf_counter()
+    for _ in range(iterations):
+        request_start = time.perf_counter()
+        status = client.get(url).status_code
+        timings.append((time.perf_counter() - request_start) * 1000)
+    elapsed = time.perf_counter() - start
+
+    profile = RequestProfile()
+    with connection.execute_wrapper(profile):
+        client.get(url)
+
+    # Память меряется отдельным запросом: tracemalloc заметно замедляет выполнение
+    tracemalloc.start()
+    try:
+        client.get(url)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    timings.sort()
+    return {
+        'url': url,
+        'status': status,
+        'requests': iterations,
+        'rps': round(iterations / elapsed, 1),
+        'p50_ms': percentile(timings, 50),
+        'p95_ms': percentile(timings, 95),
+        'p99_ms': percentile(timings, 99),
+        'max_ms': round(timings[-1], 2),
+        'queries': profile.queries,
+        'duplicate_queries': profile.duplicates,
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+def run_benchmark(user, urlpatterns, iterations, only=None):
+    caches['default'].clear()
+    # Упавшее представление попадает в отчёт с кодом 500, а не обрывает прогон
+    client = Client(raise_request_exception=False)
+    client.force_login(user)
+    results = {}
+    for name, url in benchmark_urls(urlpatterns, sample_kwargs(user)):
+        if only and not any(part in name for part in only):
+            continue
+        results[name] = measure(client, url, iterations)
+    return results
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'platform': platform.platform(),
+    }
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get('results', {}).get(name)
+        if previous is None:
+            continue
+        if current['queries'] > previous['queries']:
+            regressions.append((name, 'queries', previous['queries'], current['queries']))
+        if current['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+            regressions.append((name, 'p95_ms', previous['p95_ms'], current['p95_ms']))
+    return regressions
+
+
+def load_report(path):
+    with open(path, encoding='utf-8') as report:
+        return json.load(report)
+
+
+def save_report(path, report):
+    with open(path, 'w', encoding='utf-8') as output:
+        json.dump(report, output, ensure_ascii=False, indent=2)
+
+
+WORDS = ('python django блог пост лайк комментарий магазин товар оплата сообщение профиль лента поиск '
+         'изображение индекс запрос кеш шаблон страница пользователь категория цена заказ').split()
@@ -0,0 +1,45 @@
+from django.db.models import OuterRef, Prefetch, Q, Subquery
+
+from .models import Product, ProductImage
+from .pagination import keyset_page
+
+# Каталог магазина: фильтры по категории и цене, сортировка и keyset-пагинация.
+# Для каждой сортировки есть индекс с тем же порядком (Product.Meta.indexes), так что
+# страница читается диапазоном индекса независимо от размера каталога.
+
+CATALOG_PAGE_SIZE = 24
+CATALOG_SORTS = {
+    'new': ('-created_at', '-id'),
+    'price': ('price', 'id'),
+    '-price': ('-price', '-id'),
+}
+CATALOG_SORT_CHOICES = [
+    ('new', 'Сначала новые'),
+    ('price', 'Сначала дешёвые'),
+    ('-price', 'Сначала дорогие'),
+]
+
+
+def primary_image_prefetch():
+    # Одно изображение на товар: отмеченное главным, иначе первое по порядку
+    best = (ProductImage.objects
+            .filter(product=OuterRef('product'))
+            .exclude(Q(image='') | Q(image__isnull=True))
+            .order_by('-is_primary', 'order', 'id')
+            .values('id')[:1])
+    return Prefetch('images', queryset=ProductImage.objects.filter(id=Subquery(best)), to_attr='primary_images')
+
+
+def catalog_queryset(category=None, min_price=None, max_price=None):
+    queryset = Product.objects.select_related('category').prefetch_related(primary_image_prefetch())
+    if category is not None:
+        queryset = queryset.filter(category=category)
+    if min_price is not None:
+        queryset = queryset.filter(price__gte=min_price)
+    if max_price is not None:
+        queryset = queryset.filter(price__lte=max_price)
+    return queryset
+
+
+def get_catalog_page(sort='new', cursor=None, page_size=CATALOG_PAGE_SIZE, **filters):
+    return keyset_page(catalog_queryset(**filters), CATALOG_SORTS[sort], cursor=cursor, page_size=page_size)
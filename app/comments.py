@@ -0,0 +1,151 @@
+import re
+import time
+
+from django.core.cache import cache
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber, Substr
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from .models import Comment, COMMENT_PATH_STEP
+
+COMMENT_THREADS_PER_PAGE = 20
+COMMENT_REPLIES_PREVIEW = 5
+COMMENT_REPLIES_PER_PAGE = 20
+COMMENT_INDENT_PX = 20
+COMMENT_FRAGMENT_TIMEOUT = 60 * 10
+
+PATH_CURSOR_RE = re.compile(r'^[0-9a-z]*$')
+
+
+class InvalidPathCursor(ValueError):
+    pass
+
+
+def _check_cursor(after):
+    after = after or ''
+    if not PATH_CURSOR_RE.match(after):
+        raise InvalidPathCursor(after)
+    return after
+
+
+def comment_queryset(post):
+    return Comment.objects.filter(post=post).select_related('author__profile')
+
+
+def get_thread_page(post, after=None, threads=COMMENT_THREADS_PER_PAGE, preview=COMMENT_REPLIES_PREVIEW):
+    after = _check_cursor(after)
+
+    # 1. Корни страницы: диапазон по индексу (post, depth, path)
+    roots = list(Comment.objects
+                 .filter(post=post, depth=0, path__gt=after)
+                 .order_by('path')
+                 .values_list('path', flat=True)[:threads + 1])
+    if not roots:
+        return [], None
+
+    # 2. Ветки этих корней - один непрерывный диапазон path. Внутри каждой ветки
+    # берём корень и первые preview ответов (+1 строка, чтобы узнать, есть ли ещё)
+    page_range = Q(path__gte=roots[0])
+    next_cursor = None
+    if len(roots) > threads:
+        page_range &= Q(path__lt=roots[threads])
+        next_cursor = roots[threads - 1]
+
+    rows = (comment_queryset(post)
+            .filter(page_range)
+            .annotate(position=Window(RowNumber(),
+                                      partition_by=Substr('path', 1, COMMENT_PATH_STEP),
+                                      order_by=F('path').asc()))
+            .filter(position__lte=preview + 2)
+            .order_by('path'))
+
+    comments = []
+    thread_roots = {}
+    for comment in rows:
+        if comment.depth == 0:
+            thread_roots[comment.thread_path] = comment
+        if comment.position > preview + 1:
+            # В ветке есть ещё ответы: кнопка "ещё" выводится после последнего показанного,
+            # продолжение подгружается начиная с его path
+            root = thread_roots[comment.thread_path]
+            comments[-1].more_replies = {
+                'root_id': root.id,
+                'after': comments[-1].path,
+                'indent': COMMENT_INDENT_PX,
+            }
+            continue
+        comments.append(comment)
+    return comments, next_cursor
+
+
+def get_subtree_page(post, comment, after=None, limit=COMMENT_REPLIES_PER_PAGE):
+    after = max(_check_cursor(after), comment.path)
+    # Поддерево - диапазон путей с общим префиксом; '~' больше любого символа base36
+    rows = list(comment_queryset(post)
+                .filter(path__gt=after, path__lt=comment.path + '~')
+                .order_by('path')[:limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1].path
+    return rows, next_cursor
+
+
+# Рендер: дерево уже упорядочено по path, поэтому выводится одним циклом по плоскому
+# списку с отступом по depth, без рекурсивных include. Готовый HTML кешируется на пост
+# и сбрасывается сменой версии при добавлении/удалении комментария.
+def _comments_version_key(post_id):
+    return f'comments_version:{post_id}'
+
+
+def get_comments_version(post_id):
+    key = _comments_version_key(post_id)
+    version = cache.get(key)
+    if version is None:
+        version = time.time_ns()
+        # add(), чтобы параллельный запрос не перетёр уже выставленную версию
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+def bump_comments_version(post_id):
+    cache.set(_comments_version_key(post_id), time.time_ns(), None)
+
+
+def render_comments(post, comments):
+    for comment in comments:
+        comment.indent = comment.depth * COMMENT_INDENT_PX
+    # Без request: фрагмент общий для всех читателей и не содержит ничего персонального
+    return render_to_string('app/comment_list.html', {'post': post, 'comments': comments})
+
+
+def _cached_fragment(key, build):
+    cached = cache.get(key)
+    if cached is None:
+        cached = build()
+        cache.set(key, cached, COMMENT_FRAGMENT_TIMEOUT)
+    html, next_cursor, comment_ids = cached
+    # strip() до mark_safe: пустая страница - пустая строка, а результат остаётся безопасным
+    return mark_safe(html.strip()), next_cursor, comment_ids
+
+
+def render_thread_page(post, after=None):
+    after = _check_cursor(after)
+    key = f'comment-page:{post.id}:{get_comments_version(post.id)}:threads:{after}'
+
+    def build():
+        comments, next_cursor = get_thread_page(post, after)
+        return str(render_comments(post, comments)), next_cursor, [comment.id for comment in comments]
+    return _cached_fragment(key, build)
+
+
+def render_subtree_page(post, comment, after=None):
+    after = _check_cursor(after)
+    key = f'comment-page:{post.id}:{get_comments_version(post.id)}:subtree:{comment.id}:{after}'
+
+    def build():
+        comments, next_cursor = get_subtree_page(post, comment, after)
+        return str(render_comments(post, comments)), next_cursor, [comment.id for comment in comments]
+    return _cached_fragment(key, build)
@@ -1,7 +1,6 @@
-from .models import Message
+from .messaging import get_unread_count
 
 def unread_message_count(request):
     if request.user.is_authenticated:
-        count = Message.objects.filter(recipient=request.user, is_read=False).count()
-        return {'unread_message_count': count}
-    return {'unread_message_count': 0}
\ No newline at end of file
+        return {'unread_message_count': get_unread_count(request.user)}
+    return {'unread_message_count': 0}
@@ -0,0 +1,145 @@
+import json
+import re
+import threading
+import time
+import urllib.request
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Локальная заглушка API ЮKassa для тестов и разработки (только стандартная библиотека).
+# Поддерживает то, чем пользуется app/payments.py: создание платежа с Idempotence-Key
+# и получение платежа по id. Управляющие запросы /_control/... меняют статус платежа,
+# отправляют уведомление и включают сбои/задержки, чтобы проверить повторы и таймауты.
+#
+#     server = FakeYooKassa(); server.start()
+#     settings.YOOKASSA_API_URL = server.url
+
+PAYMENT_PATH_RE = re.compile(r'^/v3/payments/([\w-]+)$')
+
+
+class FakeYooKassa:
+    def __init__(self, host='127.0.0.1', port=0):
+        self.payments = {}
+        self.idempotence = {}
+        self.requests = []
+        self.fail_next = 0       # столько следующих запросов получат 503
+        self.delay = 0.0         # задержка ответа в секундах
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/v3'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def create_payment(self, body, idempotence_key):
+        with self.lock:
+            if idempotence_key in self.idempotence:
+                return self.payments[self.idempotence[idempotence_key]]
+            payment_id = str(uuid.uuid4())
+            payment = {
+                'id': payment_id,
+                'status': 'pending',
+                'paid': False,
+                'amount': body['amount'],
+                'description': body.get('description', ''),
+                'metadata': body.get('metadata', {}),
+                'confirmation': {
+                    'type': 'redirect',
+                    'return_url': body['confirmation']['return_url'],
+                    'confirmation_url': f'{self.url}/checkout/{payment_id}',
+                },
+                'created_at': time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime()),
+            }
+            self.payments[payment_id] = payment
+            self.idempotence[idempotence_key] = payment_id
+            return payment
+
+    def set_status(self, payment_id, status):
+        with self.lock:
+            payment = self.payments[payment_id]
+            payment['status'] = status
+            payment['paid'] = status == 'succeeded'
+            return payment
+
+    def notify(self, payment_id, webhook_url):
+        payment = self.payments[payment_id]
+        event = 'payment.succeeded' if payment['status'] == 'succeeded' else f"payment.{payment['status']}"
+        body = json.dumps({'type': 'notification', 'event': event, 'object': payment}).encode()
+        request = urllib.request.Request(webhook_url, data=body, headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status
+
+    def _handler(self):
+        gateway = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _body(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                return json.loads(self.rfile.read(length) or b'{}')
+
+            def _simulate_failure(self):
+                gateway.requests.append((self.command, self.path))
+                if gateway.delay:
+                    time.sleep(gateway.delay)
+                with gateway.lock:
+                    if gateway.fail_next > 0:
+                        gateway.fail_next -= 1
+                        self._send(503, {'type': 'error', 'code': 'internal_server_error'})
+                        return True
+                return False
+
+            def do_GET(self):
+                match = PAYMENT_PATH_RE.match(self.path)
+                if not match:
+                    return self._send(404, {'type': 'error', 'code': 'not_found'})
+                if self._simulate_failure():
+                    return
+                payment = gateway.payments.get(match.group(1))
+                if payment is None:
+                    return self._send(404, {'type': 'error', 'code': 'not_found'})
+                self._send(200, payment)
+
+            def do_POST(self):
+                body = self._body()
+                if self.path == '/v3/payments':
+                    if self._simulate_failure():
+                        return
+                    key = self.headers.get('Idempotence-Key')
+                    if not key:
+                        return self._send(400, {'type': 'error', 'code': 'invalid_request'})
+                    return self._send(200, gateway.create_payment(body, key))
+                # Управление заглушкой: {"payment_id": ..., "status": ..., "webhook_url": ...}
+                if self.path == '/_control/status':
+                    payment = gateway.set_status(body['payment_id'], body['status'])
+                    if body.get('webhook_url'):
+                        gateway.notify(payment['id'], body['webhook_url'])
+                    return self._send(200, payment)
+                if self.path == '/_control/faults':
+                    gateway.fail_next = int(body.get('fail_next', 0))
+                    gateway.delay = float(body.get('delay', 0))
+                    return self._send(200, {'fail_next': gateway.fail_next, 'delay': gateway.delay})
+                self._send(404, {'type': 'error', 'code': 'not_found'})
+
+        return Handler
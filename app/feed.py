@@ -0,0 +1,17 @@
+from .models import Post
+from .pagination import keyset_page
+
+FEED_PAGE_SIZE = 18
+FEED_ORDERING = ('created_at', 'id')
+
+
+def feed_queryset():
+    # Автор и его профиль подтягиваются JOIN'ом, а счётчики лайков/комментариев
+    # хранятся в самой строке поста - агрегатных запросов на карточку нет
+    return Post.objects.select_related('author__profile')
+
+
+def get_feed_page(cursor=None, queryset=None, page_size=FEED_PAGE_SIZE):
+    if queryset is None:
+        queryset = feed_queryset()
+    return keyset_page(queryset, FEED_ORDERING, cursor=cursor, page_size=page_size)
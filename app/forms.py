@@ -2,6 +2,7 @@ from django import forms
 from django.contrib.auth.models import User
 from django.contrib.auth.forms import UserCreationForm
 from .models import Post, Comment, UserProfile, Message
+from .catalog import CATALOG_SORT_CHOICES
 
 
 class UserRegisterForm(UserCreationForm):
@@ -107,4 +108,13 @@ class MessageForm(forms.ModelForm):
         labels = {
             'subject': 'Тема (опционально)',
             'content': 'Текст',
-        }
\ No newline at end of file
+        }
+
+# Фильтры и сортировка каталога магазина (GET-параметры)
+class CatalogFilterForm(forms.Form):
+    min_price = forms.DecimalField(required=False, min_value=0, decimal_places=2, label='Цена от',
+                                   widget=forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01'}))
+    max_price = forms.DecimalField(required=False, min_value=0, decimal_places=2, label='до',
+                                   widget=forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01'}))
+    sort = forms.ChoiceField(required=False, choices=CATALOG_SORT_CHOICES, label='Сортировка',
+                             widget=forms.Select(attrs={'class': 'form-select'}))
\ No newline at end of file
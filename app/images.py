@@ -0,0 +1,130 @@
+import hashlib
+import io
+import os
+
+from django.apps import apps
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+from . import jobs
+
+# Уменьшенные копии загруженных изображений. Генерируются фоновой задачей после
+# загрузки; до готовности шаблоны показывают оригинал (фильтр rendition).
+# Заранее строятся только копии, которые выводят шаблоны (FIELD_RENDITIONS); остальные
+# размеры - миниатюры по запросу (app/thumbnails.py). Та же задача записывает отпечаток
+# содержимого (renditions['version']), из которого миниатюры получают имена файлов.
+RENDITIONS = {
+    'card': (600, 600),
+    'full': (1600, 1600),
+}
+RENDITION_FORMAT = 'webp'
+RENDITION_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+RENDITIONS_DIR = 'renditions'
+
+# Поля с изображениями, для которых строятся копии: (модель, поле)
+IMAGE_FIELDS = [
+    ('app.post', 'image'),
+    ('app.userprofile', 'avatar'),
+    ('app.productimage', 'image'),
+]
+# Какие копии строить для поля; товарам хватает миниатюр по запросу
+FIELD_RENDITIONS = {
+    ('app.post', 'image'): ('full',),
+    ('app.userprofile', 'avatar'): ('card',),
+}
+
+
+def rendition_name(source_name, kind, fmt):
+    root, _ = os.path.splitext(source_name)
+    return f"{RENDITIONS_DIR}/{root}_{kind}.{fmt}"
+
+
+def render_image(image, size, fmt):
+    image = image.copy()
+    image.thumbnail(size)
+    if fmt == 'jpeg' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    buffer = io.BytesIO()
+    pil_format, options = RENDITION_FORMATS[fmt]
+    # EXIF и прочие метаданные в копию не передаются
+    image.save(buffer, pil_format, **options)
+    return buffer.getvalue()
+
+
+def generate_renditions(source_name, kinds, storage=default_storage):
+    with storage.open(source_name) as source:
+        data = source.read()
+    renditions = {'version': hashlib.sha1(data).hexdigest()[:20]}
+    if not kinds:
+        return renditions
+
+    image = Image.open(io.BytesIO(data))
+    # Поворот по EXIF применяется к пикселям до того, как метаданные будут отброшены
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+
+    for kind in kinds:
+        name = rendition_name(source_name, kind, RENDITION_FORMAT)
+        if storage.exists(name):
+            storage.delete(name)
+        content = ContentFile(render_image(image, RENDITIONS[kind], RENDITION_FORMAT))
+        renditions[kind] = {RENDITION_FORMAT: storage.save(name, content)}
+    return renditions
+
+
+def renditions_ready(instance, field):
+    file = getattr(instance, field)
+    renditions = instance.renditions or {}
+    return renditions.get('source') == file.name and 'version' in renditions
+
+
+def rendition_files(renditions):
+    return [name for formats in renditions.values() if isinstance(formats, dict) for name in formats.values()]
+
+
+def schedule_renditions(instance, field):
+    file = getattr(instance, field)
+    if not file or renditions_ready(instance, field):
+        return None
+    return jobs.enqueue('image.renditions', model=instance._meta.label_lower, pk=instance.pk,
+                        field=field, name=file.name)
+
+
+@jobs.handler('image.renditions')
+def build_renditions(model, pk, field, name):
+    model_class = apps.get_model(model)
+    instance = model_class.objects.filter(pk=pk).first()
+    if instance is None or getattr(instance, field).name != name:
+        # Запись удалена или файл уже заменён - задача устарела
+        return
+    if renditions_ready(instance, field):
+        return
+
+    renditions = generate_renditions(name, FIELD_RENDITIONS.get((model, field), ()))
+    # Подмена ссылок только если за время обработки файл не поменялся
+    updated = model_class.objects.filter(pk=pk, **{field: name}).update(
+        renditions={'source': name, **renditions}
+    )
+    new_files = set(rendition_files(renditions))
+    if updated:
+        stale = set(rendition_files(instance.renditions)) - new_files
+    else:
+        stale = new_files
+    for stale_name in stale:
+        default_storage.delete(stale_name)
+
+
+def rendition_url(file, kind, fmt='webp'):
+    if not file:
+        return ''
+    renditions = getattr(file.instance, 'renditions', None) or {}
+    if renditions.get('source') == file.name:
+        name = renditions.get(kind, {}).get(fmt)
+        if name:
+            return default_storage.url(name)
+    return file.url
@@ -0,0 +1,94 @@
+import logging
+import os
+import socket
+import traceback
+from datetime import timedelta
+
+from django.db import close_old_connections, connections
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+JOB_MAX_ATTEMPTS = 3
+JOB_STALE_AFTER = timedelta(minutes=15)
+# Повтор после ошибки: 30 с, 2 мин, 8 мин... - временный сбой успевает пройти
+JOB_RETRY_DELAY = timedelta(seconds=30)
+
+# Очередь фоновых задач в БД. Задача ставится в той же транзакции, что и изменение,
+# которое её порождает, поэтому воркер не увидит задачу к откатившимся данным.
+_handlers = {}
+
+
+def handler(kind):
+    def register(func):
+        _handlers[kind] = func
+        return func
+    return register
+
+
+def enqueue(kind, **payload):
+    return Job.objects.create(kind=kind, payload=payload)
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def requeue_stale(stale_after=JOB_STALE_AFTER):
+    # Задачи упавшего воркера возвращаются в очередь
+    return (Job.objects
+            .filter(status='running', started_at__lt=timezone.now() - stale_after)
+            .update(status='pending', locked_by=''))
+
+
+def retry_delay(attempts):
+    return JOB_RETRY_DELAY * 4 ** max(attempts - 1, 0)
+
+
+def claim(batch_size, worker=None):
+    worker = worker or worker_name()
+    ids = list(Job.objects.filter(status='pending', run_after__lte=timezone.now())
+               .order_by('id').values_list('id', flat=True)[:batch_size])
+    if not ids:
+        return []
+    # Один UPDATE с условием на статус: задачу, которую успел взять другой воркер, он не перезапишет
+    Job.objects.filter(pk__in=ids, status='pending').update(
+        status='running', locked_by=worker, started_at=timezone.now(), attempts=F('attempts') + 1,
+    )
+    return list(Job.objects.filter(pk__in=ids, status='running', locked_by=worker).values_list('id', flat=True))
+
+
+def run_job(job_id):
+    job = Job.objects.get(pk=job_id)
+    func = _handlers.get(job.kind)
+    try:
+        if func is None:
+            raise LookupError(f"Нет обработчика для задачи {job.kind}")
+        func(**job.payload)
+    except Exception:
+        logger.exception("Задача %s (%s) завершилась ошибкой", job.id, job.kind)
+        status = 'failed' if job.attempts >= JOB_MAX_ATTEMPTS else 'pending'
+        now = timezone.now()
+        Job.objects.filter(pk=job.pk).update(status=status, locked_by='', error=traceback.format_exc(),
+                                             finished_at=now, run_after=now + retry_delay(job.attempts))
+        return False
+    Job.objects.filter(pk=job.pk).update(status='done', locked_by='', error='', finished_at=timezone.now())
+    return True
+
+
+def init_worker_process():
+    # Дочерний процесс пула не должен пользоваться соединениями родителя
+    import django
+    django.setup()
+    connections.close_all()
+
+
+def run_job_in_worker(job_id):
+    close_old_connections()
+    try:
+        return run_job(job_id)
+    finally:
+        close_old_connections()
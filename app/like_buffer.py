@@ -0,0 +1,354 @@
+import atexit
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections, transaction
+from django.db.models import F
+
+from . import trending
+from .models import Post, Like
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Отложенная запись лайков (настройка LIKE_WRITE_BEHIND). Лайк не пишется в БД сразу:
+# желаемое состояние пары (пользователь, пост) дописывается строкой в журнал процесса
+# и запоминается в памяти, а фоновый поток раз в LIKE_BUFFER_INTERVAL секунд (или когда
+# набралось LIKE_BUFFER_MAX пар) записывает всё одной транзакцией: bulk_create новых
+# лайков, одно удаление снятых и по одному UPDATE счётчика на пост. Серия кликов по
+# одному посту превращается в одну запись вместо транзакции с блокировкой на каждый клик.
+#
+# Пока пачка не записана, состояние из буфера накладывается на прочитанное из БД
+# (set_reaction, load_viewer_state): пользователь сразу видит свой лайк и счётчик.
+# Буфер свой у каждого процесса, поэтому в другом процессе лайк появится после записи.
+#
+# Журнал держит flock всё время, пока процесс жив. Журнал без блокировки остался от
+# упавшего процесса: его докатывает следующий процесс при старте или команда
+# flush_like_buffer. Применение пачки идемпотентно - в журнале желаемые состояния,
+# а изменения счётчиков считаются по фактическим строкам в БД.
+
+LIKE_BUFFER_INTERVAL = 1.0
+LIKE_BUFFER_MAX = 500
+LIKE_BUFFER_CHUNK_SIZE = 500
+
+_flushing = ContextVar('like_buffer_flushing', default=False)
+
+
+def enabled():
+    return getattr(settings, 'LIKE_WRITE_BEHIND', False)
+
+
+def is_flushing():
+    # Сигналы лайков (app/signals.py) молчат: счётчики пачки меняются одним UPDATE на пост
+    return _flushing.get()
+
+
+@contextmanager
+def _muted_signals():
+    token = _flushing.set(True)
+    try:
+        yield
+    finally:
+        _flushing.reset(token)
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _change_like_count(post_id, delta):
+    queryset = Post.objects.filter(pk=post_id)
+    if delta < 0:
+        queryset = queryset.filter(like_count__gte=-delta)
+    queryset.update(like_count=F('like_count') + delta)
+
+
+def apply_likes(states, chunk_size=LIKE_BUFFER_CHUNK_SIZE):
+    # states: {(user_id, post_id): True/False} - каким должен стать лайк
+    deltas = Counter()
+    # Очки "Популярного" по часам: снятый лайк вычитается из часа, когда он был поставлен
+    hourly = Counter()
+    with transaction.atomic(), _muted_signals():
+        for chunk in _chunks(list(states.items()), chunk_size):
+            user_ids = {user_id for (user_id, _), _ in chunk}
+            post_ids = {post_id for (_, post_id), _ in chunk}
+            existing = {
+                (user_id, post_id): (pk, created_at) for pk, user_id, post_id, created_at in
+                Like.objects.filter(user_id__in=user_ids, post_id__in=post_ids)
+                .values_list('id', 'user_id', 'post_id', 'created_at')
+            }
+            # Пост или пользователь могли быть удалены, пока лайк ждал в буфере
+            live_posts = set(Post.objects.filter(pk__in=post_ids).values_list('id', flat=True))
+            live_users = set(User.objects.filter(pk__in=user_ids).values_list('id', flat=True))
+
+            added = [Like(user_id=user_id, post_id=post_id) for (user_id, post_id), active in chunk
+                     if active and (user_id, post_id) not in existing
+                     and user_id in live_users and post_id in live_posts]
+            removed = [existing[pair][0] for pair, active in chunk if not active and pair in existing]
+
+            Like.objects.bulk_create(added, ignore_conflicts=True)
+            # Между чтением и вставкой строку мог вставить другой процесс (его буфер или
+            # replay_orphans) - тогда вставка молча пропущена. Своими считаются только строки
+            # с тем created_at, который bulk_create проставил нашим объектам
+            stamps = {(like.user_id, like.post_id): like.created_at for like in added}
+            if stamps:
+                rows = (Like.objects.filter(user_id__in={user_id for user_id, _ in stamps},
+                                            post_id__in={post_id for _, post_id in stamps})
+                        .values_list('user_id', 'post_id', 'created_at'))
+                for user_id, post_id, created_at in rows:
+                    if stamps.get((user_id, post_id)) == created_at:
+                        deltas[post_id] += 1
+                        hourly[post_id, trending.bucket_start(created_at)] += 1
+
+            if removed:
+                # Блокировка строк: снятые параллельно сюда не попадут и не будут вычтены дважды
+                deleted = list(Like.objects.select_for_update().filter(pk__in=removed)
+                               .values_list('id', 'post_id', 'created_at'))
+                Like.objects.filter(pk__in=[pk for pk, _, _ in deleted]).delete()
+                for _, post_id, created_at in deleted:
+                    deltas[post_id] -= 1
+                    hourly[post_id, trending.bucket_start(created_at)] -= 1
+
+        for post_id, delta in deltas.items():
+            if delta:
+                _change_like_count(post_id, delta)
+        for (post_id, hour), delta in hourly.items():
+            if delta:
+                trending.record_activity(post_id, 'like', delta, moment=hour)
+    return deltas
+
+
+def read_log(path):
+    states = {}
+    with open(path, 'rb') as log:
+        for line in log:
+            try:
+                entry = json.loads(line)
+                states[(entry['u'], entry['p'])] = bool(entry['a'])
+            except (ValueError, KeyError, TypeError):
+                # Недописанная строка: процесс упал посреди записи
+                continue
+    return states
+
+
+class LikeBuffer:
+    def __init__(self, directory, interval=LIKE_BUFFER_INTERVAL, max_size=LIKE_BUFFER_MAX):
+        if fcntl is None:
+            raise ImproperlyConfigured("LIKE_WRITE_BEHIND требует fcntl (Linux/macOS)")
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.interval = interval
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # (user_id, post_id) -> [состояние в БД до буфера, желаемое состояние]
+        self._pending = {}
+        # Пачка, которая сейчас записывается: видна читателям до коммита
+        self._inflight = {}
+        self._log = None
+        # Журналы пачек, запись которых не удалась; удаляются после успешной записи
+        self._retained = []
+        self._wake = threading.Event()
+        self._thread = None
+
+    def _open_log(self):
+        path = self.directory / f'likes-{socket.gethostname()}-{os.getpid()}-{time.time_ns()}.log'
+        log = open(path, 'ab', buffering=0)
+        fcntl.flock(log, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return log
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='like-buffer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Не удалось записать лайки из буфера")
+            finally:
+                close_old_connections()
+
+    def _known_state(self, pair):
+        if pair in self._pending:
+            return self._pending[pair][1]
+        if pair in self._inflight:
+            return self._inflight[pair][1]
+        return None
+
+    def state(self, user_id, post_id):
+        pair = (user_id, post_id)
+        with self._lock:
+            known = self._known_state(pair)
+        if known is None:
+            known = Like.objects.filter(user_id=user_id, post_id=post_id).exists()
+        return known
+
+    def record(self, user_id, post_id, active=None):
+        pair = (user_id, post_id)
+        # Текущее состояние с учётом буфера; для новой пары оно же исходное
+        base = self.state(user_id, post_id)
+        if active is None:
+            active = not base
+        line = json.dumps({'u': user_id, 'p': post_id, 'a': active, 't': time.time()}).encode() + b'\n'
+        with self._lock:
+            if self._log is None:
+                self._log = self._open_log()
+            # Сначала журнал, потом память: принятый лайк переживёт падение процесса
+            self._log.write(line)
+            self._pending.setdefault(pair, [base, active])[1] = active
+            size = len(self._pending)
+        self._start()
+        if size >= self.max_size:
+            self._wake.set()
+        return active
+
+    def overlay(self, user_id, post_ids):
+        # Лайки пользователя и изменения счётчиков, ещё не записанные в БД
+        post_ids = set(post_ids)
+        liked = {}
+        deltas = Counter()
+        with self._lock:
+            # Исходное состояние пары в _pending - итог пачки в _inflight, поэтому
+            # изменения из обоих источников просто складываются
+            for source in (self._inflight, self._pending):
+                for (pair_user, post_id), (base, active) in source.items():
+                    if post_id not in post_ids:
+                        continue
+                    deltas[post_id] += active - base
+                    if pair_user == user_id:
+                        liked[post_id] = active
+        return liked, deltas
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                batch, self._pending = self._pending, {}
+                self._inflight = batch
+                log, self._log = self._log, None
+            locked = False
+            try:
+                with transaction.atomic():
+                    apply_likes({pair: active for pair, (_, active) in batch.items()})
+                    # Коммит и очистка _inflight под одной блокировкой: читатель (overlay)
+                    # не увидит пачку одновременно в БД и в _inflight
+                    self._lock.acquire()
+                    locked = True
+            except Exception:
+                if not locked:
+                    self._lock.acquire()
+                try:
+                    # Пачка возвращается в буфер; более новые состояния важнее
+                    for pair, entry in batch.items():
+                        if pair in self._pending:
+                            self._pending[pair][0] = entry[0]
+                        else:
+                            self._pending[pair] = entry
+                    self._inflight = {}
+                    self._retained.append(log)
+                finally:
+                    self._lock.release()
+                raise
+            try:
+                self._inflight = {}
+                retained, self._retained = self._retained + [log], []
+            finally:
+                self._lock.release()
+            for done in retained:
+                os.unlink(done.name)
+                done.close()
+            return len(batch)
+
+
+def replay_orphans(directory):
+    # Журналы процессов, которые завершились, не успев записать буфер
+    replayed = 0
+    for path in sorted(Path(directory).glob('likes-*.log')):
+        try:
+            log = open(path, 'rb')
+        except FileNotFoundError:
+            continue
+        try:
+            try:
+                fcntl.flock(log, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Процесс-владелец жив
+                continue
+            if not path.exists():
+                # Уже докатан другим процессом, пока ждали блокировку
+                continue
+            states = read_log(path)
+            if states:
+                apply_likes(states)
+            path.unlink()
+            replayed += len(states)
+        finally:
+            log.close()
+    if replayed:
+        logger.info("Докатано лайков из журналов: %s", replayed)
+    return replayed
+
+
+_buffer = None
+_buffer_pid = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    global _buffer, _buffer_pid
+    with _buffer_lock:
+        # После fork у дочернего процесса свой буфер и свой журнал
+        if _buffer is None or _buffer_pid != os.getpid():
+            directory = getattr(settings, 'LIKE_BUFFER_DIR', Path(settings.BASE_DIR) / 'like_buffer')
+            _buffer = LikeBuffer(directory,
+                                 interval=getattr(settings, 'LIKE_BUFFER_INTERVAL', LIKE_BUFFER_INTERVAL),
+                                 max_size=getattr(settings, 'LIKE_BUFFER_MAX', LIKE_BUFFER_MAX))
+            _buffer_pid = os.getpid()
+            replay_orphans(directory)
+            atexit.register(_buffer.flush)
+        return _buffer
+
+
+def set_like(user, post, active=None):
+    buffer = get_buffer()
+    active = buffer.record(user.id, post.pk, active)
+    # Сначала БД, потом буфер: пачка, записанная между ними, может на миг не попасть в счётчик,
+    # но не будет учтена дважды (flush очищает _inflight вместе с коммитом)
+    count = Post.objects.filter(pk=post.pk).values_list('like_count', flat=True).get()
+    liked, deltas = buffer.overlay(user.id, [post.pk])
+    return active, max(count + deltas[post.pk], 0)
+
+
+def apply_overlay(user, posts):
+    # Для load_viewer_state: лайки и счётчики с учётом ещё не записанного буфера.
+    # Посты уже прочитаны из БД, буфер читается после - порядок как в set_like
+    if not enabled() or not posts:
+        return
+    liked, deltas = get_buffer().overlay(user.id, [post.id for post in posts])
+    for post in posts:
+        if post.id in liked:
+            post.viewer_liked = liked[post.id]
+        post.like_count = max(post.like_count + deltas[post.id], 0)
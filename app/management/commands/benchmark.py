@@ -0,0 +1,66 @@
+import shutil
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import (override_settings, setup_databases, setup_test_environment,
+                               teardown_databases, teardown_test_environment)
+
+from app import urls
+from app.benchmark import (DEFAULT_DATASET, compare, environment, generate_dataset, load_report, run_benchmark,
+                           save_report)
+
+
+class Command(BaseCommand):
+    help = ("Создаёт временную БД с синтетическими данными, прогоняет представления из app/urls.py "
+            "и выводит задержки, число запросов и пик памяти; умеет сравнивать с сохранённым базовым прогоном")
+
+    def add_arguments(self, parser):
+        for name, default in DEFAULT_DATASET.items():
+            parser.add_argument(f"--{name.replace('_', '-')}", type=int, default=default, dest=name)
+        parser.add_argument('--iterations', type=int, default=20, help="Запросов на каждый URL")
+        parser.add_argument('--only', nargs='*', help="Прогнать только URL, в имени которых есть подстрока")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help="Куда записать JSON с результатами")
+        parser.add_argument('--baseline', help="JSON прошлого прогона для сравнения")
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help="Допустимый рост p95 относительно базового прогона (0.25 = 25%%)")
+
+    def handle(self, *args, **options):
+        dataset = {name: options[name] for name in DEFAULT_DATASET}
+        baseline = load_report(options['baseline']) if options['baseline'] else None
+
+        media_root = tempfile.mkdtemp(prefix='benchmark-media-')
+        setup_test_environment()
+        # Отдельная тестовая БД (для SQLite - в памяти): рабочие данные не затрагиваются
+        old_config = setup_databases(verbosity=0, interactive=False, aliases={'default'})
+        try:
+            with override_settings(MEDIA_ROOT=media_root, DEBUG=False):
+                self.stdout.write(f"Генерация данных: {dataset}")
+                users = generate_dataset(dataset, seed=options['seed'])
+                results = run_benchmark(users[0], urls.urlpatterns, options['iterations'], options['only'])
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        self.stdout.write(f"{'URL':<55} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'SQL':>5} {'дубл':>5} {'KB':>8}")
+        for name, result in results.items():
+            self.stdout.write(f"{name:<55} {result['rps']:>8} {result['p50_ms']:>8} {result['p95_ms']:>8} "
+                              f"{result['p99_ms']:>8} {result['queries']:>5} {result['duplicate_queries']:>5} "
+                              f"{result['peak_kb']:>8}")
+            if result['status'] != 200:
+                self.stdout.write(self.style.WARNING(f"  код ответа {result['status']}"))
+
+        report = {'environment': environment(), 'dataset': dataset, 'iterations': options['iterations'],
+                  'results': results}
+        if options['output']:
+            save_report(options['output'], report)
+            self.stdout.write(f"Результаты записаны в {options['output']}")
+
+        if baseline:
+            regressions = compare(results, baseline, options['tolerance'])
+            for name, metric, before, after in regressions:
+                self.stdout.write(self.style.ERROR(f"{name}: {metric} {before} -> {after}"))
+            if regressions:
+                raise CommandError(f"Регрессий относительно базового прогона: {len(regressions)}")
+            self.stdout.write(self.style.SUCCESS("Регрессий относительно базового прогона нет"))
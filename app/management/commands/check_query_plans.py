@@ -0,0 +1,106 @@
+import re
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from app.catalog import CATALOG_SORTS, catalog_queryset, primary_image_prefetch
+from app.comments import comment_queryset
+from app.feed import FEED_ORDERING, feed_queryset
+from app.messaging import conversation_directions, inbox_queryset, unread_messages
+from app.models import (Post, Like, Comment, CommentLike, Favorite, Follow, UserProfile, Conversation,
+                        Category, Job, TimelineEntry, TrendingBucket)
+from app.pagination import keyset_filter
+from app.timeline import FANOUT_MAX_FOLLOWERS, TIMELINE_ORDERING
+from app.trending import TRENDING_SIZE, bucket_start, trending_queryset
+
+# SCAN без индекса; "SCAN t USING INDEX ..." и виртуальные таблицы (FTS) - не полный проход
+FULL_SCAN_RE = re.compile(r'\bSCAN (\w+)\b(?! USING)(?! VIRTUAL TABLE)')
+
+# Таблицы-справочники, которые выводятся целиком
+SMALL_TABLES = {Category._meta.db_table}
+
+
+def query_plans():
+    # Запросы, которые выполняют представления, с условными значениями параметров
+    user = User(pk=1)
+    contact = User(pk=2)
+    post = Post(pk=1)
+    feed_cursor = keyset_filter(FEED_ORDERING, ['2000-01-01T00:00:00+00:00', 1])
+    return [
+        ('home: лента', feed_queryset().order_by(*FEED_ORDERING)[:19]),
+        ('home: следующая страница', feed_queryset().filter(feed_cursor).order_by(*FEED_ORDERING)[:19]),
+        ('my_posts', feed_queryset().filter(author=user).order_by(*FEED_ORDERING)[:19]),
+        ('favorites', feed_queryset().filter(favorited_by__user=user).order_by('-favorited_by__created_at')[:20]),
+        ('timeline: лента', TimelineEntry.objects.filter(user=user).order_by(*TIMELINE_ORDERING)
+         .values_list('score', 'post_id')[:19]),
+        ('timeline: следующая страница', TimelineEntry.objects.filter(user=user)
+         .filter(keyset_filter(TIMELINE_ORDERING, [100000.0, 1000])).order_by(*TIMELINE_ORDERING)
+         .values_list('score', 'post_id')[:19]),
+        ('timeline: пересчёт оценки', TimelineEntry.objects.filter(post=post).exclude(score=0)),
+        ('timeline: популярные авторы', Follow.objects.filter(
+            follower=user, author_id__in=UserProfile.objects.filter(follower_count__gte=FANOUT_MAX_FOLLOWERS)
+            .values('user_id')).values_list('author_id')),
+        ('timeline: посты популярного автора', Post.objects.filter(author=contact)
+         .order_by('-id').values_list('id')[:50]),
+        ('fan_out: подписчики', Follow.objects.filter(author=user, id__gt=1).order_by('id')
+         .values_list('id', 'follower_id')[:1000]),
+        ('trending: очки поста за час', TrendingBucket.objects.filter(post=post, bucket=bucket_start())),
+        ('trending: топ за окно', trending_queryset()[:TRENDING_SIZE]),
+        ('viewer_state: лайки читателя', Like.objects.filter(user=user, post_id__in=[1, 2, 3]).values_list('post_id')),
+        ('viewer_state: избранное читателя',
+         Favorite.objects.filter(user=user, post_id__in=[1, 2, 3]).values_list('post_id')),
+        ('viewer_state: лайки комментариев',
+         CommentLike.objects.filter(user=user, comment_id__in=[1, 2, 3]).values_list('comment_id')),
+        ('post_detail: ветки комментариев',
+         Comment.objects.filter(post=post, depth=0, path__gt='').order_by('path').values_list('path')[:21]),
+        ('post_detail: ответы', comment_queryset(post).filter(path__gt='00000001', path__lt='00000001~')
+         .order_by('path')[:21]),
+        ('messages_list: диалоги', inbox_queryset(user)[:30]),
+        *[(f'messages_list: переписка, направление {number}', queryset.order_by('-id')[:51])
+          for number, queryset in enumerate(conversation_directions(user, contact, id__lt=1000), 1)],
+        *[(f'conversation_messages: since, направление {number}', queryset.order_by('id')[:201])
+          for number, queryset in enumerate(conversation_directions(user, contact, id__gt=1), 1)],
+        ('messages_list: непрочитанные после водяного знака', unread_messages(user, contact, 1000)),
+        ('messages_list: сводка', Conversation.objects.filter(user=user, contact=contact)),
+        *[(f'shop: каталог, сортировка {sort}', catalog_queryset().order_by(*ordering)[:25])
+          for sort, ordering in CATALOG_SORTS.items()],
+        *[(f'shop: категория, сортировка {sort}', catalog_queryset(category=1).order_by(*ordering)[:25])
+          for sort, ordering in CATALOG_SORTS.items()],
+        ('shop: главные изображения', primary_image_prefetch().queryset.filter(product_id__in=[1, 2, 3])),
+        ('shop: категории', Category.objects.all()),
+        ('run_jobs: очередь', Job.objects.filter(status='pending', run_after__lte=timezone.now())
+         .order_by('id').values_list('id')[:10]),
+    ]
+
+
+def full_scans(plan):
+    return [table for table in FULL_SCAN_RE.findall(plan) if table not in SMALL_TABLES]
+
+
+class Command(BaseCommand):
+    help = "Выполняет EXPLAIN для запросов представлений и падает, если какой-то из них читает таблицу целиком"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verbose-plans', action='store_true', help="Печатать планы всех запросов")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("Разбор планов написан для SQLite (EXPLAIN QUERY PLAN)")
+
+        failed = []
+        for name, queryset in query_plans():
+            plan = queryset.explain()
+            scans = full_scans(plan)
+            if scans:
+                failed.append(name)
+                self.stdout.write(self.style.ERROR(f"{name}: полный проход по {', '.join(scans)}"))
+            else:
+                self.stdout.write(f"{name}: ok")
+            if scans or options['verbose_plans']:
+                self.stdout.write(plan)
+
+        if failed:
+            raise CommandError(f"Запросов с полным проходом: {len(failed)}")
+        self.stdout.write(self.style.SUCCESS("Все запросы используют индексы"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from app.trending import compact_trending
+
+
+class Command(BaseCommand):
+    help = "Удаляет устаревшие часы активности и пересчитывает топ популярных постов (запускать по расписанию)"
+
+    def handle(self, *args, **options):
+        removed, top = compact_trending()
+        self.stdout.write(self.style.SUCCESS(f"Удалено часов: {removed}, постов в топе: {len(top)}"))
@@ -0,0 +1,12 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from app.like_buffer import replay_orphans
+
+
+class Command(BaseCommand):
+    help = "Докатывает в БД лайки из журналов завершившихся процессов (LIKE_WRITE_BEHIND)"
+
+    def handle(self, *args, **options):
+        replayed = replay_orphans(settings.LIKE_BUFFER_DIR)
+        self.stdout.write(self.style.SUCCESS(f"Докатано лайков: {replayed}"))
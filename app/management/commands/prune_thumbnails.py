@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from app.thumbnails import THUMBNAIL_CACHE_MAX_BYTES, prune_thumbnails
+
+
+class Command(BaseCommand):
+    help = "Удаляет давно не использованные миниатюры, если каталог кеша превысил лимит"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-bytes', type=int, default=THUMBNAIL_CACHE_MAX_BYTES)
+
+    def handle(self, *args, **options):
+        removed = prune_thumbnails(options['max_bytes'])
+        self.stdout.write(self.style.SUCCESS(f"Удалено миниатюр: {removed}"))
@@ -0,0 +1,25 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from app.media_cleanup import find_orphans
+
+
+class Command(BaseCommand):
+    help = "Удаляет из MEDIA_ROOT файлы, на которые не ссылается ни одна запись"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-age', type=int, default=60 * 60,
+                            help="Не трогать файлы моложе указанного числа секунд")
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true', help="Только показать найденные файлы")
+
+    def handle(self, *args, **options):
+        total = 0
+        for name in find_orphans(options['min_age'], options['chunk_size']):
+            if options['dry_run']:
+                self.stdout.write(name)
+            else:
+                default_storage.delete(name)
+            total += 1
+        verb = "Найдено" if options['dry_run'] else "Удалено"
+        self.stdout.write(self.style.SUCCESS(f"{verb} неиспользуемых файлов: {total}"))
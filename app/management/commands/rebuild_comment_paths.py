@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from app.models import Comment, COMMENT_MAX_DEPTH, comment_path_segment
+
+
+class Command(BaseCommand):
+    help = "Заполняет материализованные пути (path/depth) комментариев, пост за постом"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        post_ids = Comment.objects.order_by().values_list('post_id', flat=True).distinct()
+        total = 0
+        for post_id in post_ids.iterator():
+            # Родитель всегда создан раньше ответа, поэтому достаточно одного прохода по id
+            rows = Comment.objects.filter(post_id=post_id).order_by('id').values_list('id', 'parent_id')
+            nodes = {}
+            changed = []
+            for pk, parent_id in rows.iterator():
+                parent = nodes.get(parent_id)
+                if parent and parent.depth >= COMMENT_MAX_DEPTH:
+                    parent = nodes.get(parent.parent_id)
+                comment = Comment(id=pk, parent_id=parent.id if parent else None)
+                comment.path = (parent.path if parent else '') + comment_path_segment(pk)
+                comment.depth = parent.depth + 1 if parent else 0
+                nodes[pk] = comment
+                changed.append(comment)
+
+            with transaction.atomic():
+                Comment.objects.bulk_update(changed, ['parent', 'path', 'depth'], batch_size=options['batch_size'])
+            total += len(changed)
+
+        self.stdout.write(self.style.SUCCESS(f"Обновлено комментариев: {total}"))
@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Max, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from app.models import Conversation, Message
+
+
+class Command(BaseCommand):
+    help = "Заново строит сводную таблицу переписок (Conversation) по таблице сообщений"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        # Водяные знаки прочтения переносятся в новую сводку как есть
+        watermarks = {(user_id, contact_id): last_read_id for user_id, contact_id, last_read_id
+                      in Conversation.objects.values_list('user_id', 'contact_id', 'last_read_id').iterator()}
+        watermark = (Conversation.objects.filter(user=OuterRef('recipient'), contact=OuterRef('sender'))
+                     .values('last_read_id'))
+        # Перенос прежних отметок Message.is_read: водяной знак не ниже последнего
+        # прочитанного сообщения пары (повторный запуск ничего не меняет)
+        read_id = (Message.objects.filter(recipient=OuterRef('recipient'), sender=OuterRef('sender'), is_read=True)
+                   .order_by('-id').values('id')[:1])
+        read_watermark = Greatest(Coalesce(Subquery(watermark), 0), Coalesce(Subquery(read_id), 0))
+
+        # Одна агрегация по парам (отправитель, получатель) вместо обхода сообщений;
+        # непрочитанные - сообщения после водяного знака получателя
+        pairs = (Message.objects.order_by().values('sender_id', 'recipient_id')
+                 .annotate(last_id=Max('id'),
+                           read_id=Max('id', filter=Q(is_read=True)),
+                           unread=Count('id', filter=Q(id__gt=read_watermark))))
+
+        summary = {}
+        for row in pairs.iterator():
+            sender_id, recipient_id = row['sender_id'], row['recipient_id']
+            for key in ((sender_id, recipient_id), (recipient_id, sender_id)):
+                entry = summary.setdefault(key, {'last_id': 0, 'unread': 0})
+                entry['last_id'] = max(entry['last_id'], row['last_id'])
+            summary[(recipient_id, sender_id)]['unread'] += row['unread']
+            if row['read_id']:
+                key = (recipient_id, sender_id)
+                watermarks[key] = max(watermarks.get(key, 0), row['read_id'])
+
+        last_ids = sorted({entry['last_id'] for entry in summary.values()})
+        timestamps = {}
+        for start in range(0, len(last_ids), batch_size):
+            chunk = last_ids[start:start + batch_size]
+            timestamps.update(Message.objects.filter(id__in=chunk).values_list('id', 'timestamp'))
+
+        conversations = [
+            Conversation(user_id=user_id, contact_id=contact_id, last_message_id=entry['last_id'],
+                         last_message_at=timestamps[entry['last_id']], unread_count=entry['unread'],
+                         last_read_id=watermarks.get((user_id, contact_id), 0))
+            for (user_id, contact_id), entry in summary.items()
+        ]
+        with transaction.atomic():
+            Conversation.objects.all().delete()
+            Conversation.objects.bulk_create(conversations, batch_size=batch_size)
+
+        self.stdout.write(self.style.SUCCESS(f"Переписок создано: {len(conversations)}"))
@@ -0,0 +1,23 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from app.images import IMAGE_FIELDS, schedule_renditions
+
+
+class Command(BaseCommand):
+    help = "Ставит в очередь построение копий и отпечатков для изображений, у которых их нет"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        total = 0
+        for model_label, field in IMAGE_FIELDS:
+            queryset = (apps.get_model(model_label).objects
+                        .exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+                        .only('pk', field, 'renditions'))
+            for instance in queryset.iterator(chunk_size=options['chunk_size']):
+                # Готовые записи schedule_renditions пропускает сам
+                if schedule_renditions(instance, field) is not None:
+                    total += 1
+        self.stdout.write(self.style.SUCCESS(f"Поставлено задач: {total}"))
@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from app.search import get_backend
+
+
+class Command(BaseCommand):
+    help = "Полностью перестраивает поисковый индекс постов, комментариев и товаров"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        started = time.monotonic()
+        backend.rebuild(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Индекс ({type(backend).__name__}) перестроен за {time.monotonic() - started:.1f} с"
+        ))
@@ -0,0 +1,31 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from app.reconcile import RECONCILE_CHUNK_SIZE, RECONCILE_CONCURRENCY, reconcile_orders
+
+
+class Command(BaseCommand):
+    help = "Сверяет заказы в ожидании оплаты со статусами платежей в ЮKassa (запускать по расписанию)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-age', type=int, default=15 * 60,
+                            help="Проверять заказы старше указанного числа секунд")
+        parser.add_argument('--chunk-size', type=int, default=RECONCILE_CHUNK_SIZE)
+        parser.add_argument('--concurrency', type=int, default=RECONCILE_CONCURRENCY,
+                            help="Сколько запросов к ЮKassa выполнять одновременно")
+        parser.add_argument('--dry-run', action='store_true', help="Только показать, что изменится")
+
+    def handle(self, *args, **options):
+        stats = reconcile_orders(
+            min_age=timedelta(seconds=options['min_age']),
+            chunk_size=options['chunk_size'],
+            concurrency=options['concurrency'],
+            dry_run=options['dry_run'],
+        )
+        self.stdout.write(
+            f"Проверено: {stats['checked']}, оплачено: {stats['paid']}, отменено: {stats['cancelled']}, "
+            f"без изменений: {stats['unchanged']}, ошибок: {stats['failed']}"
+        )
+        style = self.style.WARNING if stats['failed'] else self.style.SUCCESS
+        self.stdout.write(style(f"Время: {stats['seconds']} с, {stats['per_second']} заказов/с"))
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from app.models import Post, Like, Comment, CommentLike, Favorite, Follow, UserProfile
+
+# (модель со счётчиком, поле счётчика, модель-источник, FK источника, на что он ссылается)
+COUNTERS = [
+    (Post, 'like_count', Like, 'post', 'pk'),
+    (Post, 'comment_count', Comment, 'post', 'pk'),
+    (Post, 'favorite_count', Favorite, 'post', 'pk'),
+    (Comment, 'like_count', CommentLike, 'comment', 'pk'),
+    (UserProfile, 'follower_count', Follow, 'author', 'user_id'),
+]
+
+
+def actual_count(source, fk, target='pk'):
+    counts = (source.objects.filter(**{fk: OuterRef(target)})
+              .order_by().values(fk).annotate(total=Count('*')).values('total'))
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает денормализованные счётчики лайков/комментариев/избранного/подписчиков и чинит расхождения"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Только показать число расхождений")
+
+    def handle(self, *args, **options):
+        for model, field, source, fk, target in COUNTERS:
+            drifted = (model.objects
+                       .annotate(actual=actual_count(source, fk, target))
+                       .filter(~Q(**{field: F('actual')}))
+                       .values('pk'))
+            label = f"{model.__name__}.{field}"
+
+            if options['dry_run']:
+                self.stdout.write(f"{label}: расхождений {drifted.count()}")
+                continue
+
+            # Один UPDATE ... WHERE pk IN (...) на каждый счётчик, без обхода строк в Python
+            with transaction.atomic():
+                fixed = model.objects.filter(pk__in=drifted).update(**{field: actual_count(source, fk, target)})
+            self.stdout.write(self.style.SUCCESS(f"{label}: исправлено {fixed}"))
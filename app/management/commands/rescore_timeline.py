@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from app.timeline import rescore_recent, rescore_timeline
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает оценку постов с недавней активностью в лентах подписок (запускать по расписанию)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="Пересчитать все посты в лентах")
+
+    def handle(self, *args, **options):
+        updated = rescore_timeline() if options['all'] else rescore_recent()
+        self.stdout.write(self.style.SUCCESS(f"Обновлено записей лент: {updated}"))
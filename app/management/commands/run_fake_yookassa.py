@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from app.fake_yookassa import FakeYooKassa
+
+
+class Command(BaseCommand):
+    help = "Запускает локальную заглушку API ЮKassa (для разработки: YOOKASSA_API_URL=<адрес>)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+
+    def handle(self, *args, **options):
+        gateway = FakeYooKassa(options['host'], options['port'])
+        self.stdout.write(self.style.SUCCESS(f"Заглушка ЮKassa: {gateway.url}"))
+        try:
+            gateway.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            gateway.server.server_close()
@@ -0,0 +1,33 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from app import jobs
+
+
+class Command(BaseCommand):
+    help = "Воркер фоновых задач: забирает задачи из очереди в БД и выполняет их в пуле процессов"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=2)
+        parser.add_argument('--batch-size', type=int, default=20)
+        parser.add_argument('--poll-interval', type=float, default=1.0)
+        parser.add_argument('--once', action='store_true', help="Разобрать очередь и выйти")
+
+    def handle(self, *args, **options):
+        requeued = jobs.requeue_stale()
+        if requeued:
+            self.stdout.write(f"Возвращено в очередь зависших задач: {requeued}")
+
+        worker = jobs.worker_name()
+        with ProcessPoolExecutor(max_workers=options['processes'], initializer=jobs.init_worker_process) as pool:
+            while True:
+                job_ids = jobs.claim(options['batch_size'], worker=worker)
+                if not job_ids:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+                results = list(pool.map(jobs.run_job_in_worker, job_ids))
+                self.stdout.write(f"Выполнено задач: {sum(results)}, с ошибкой: {results.count(False)}")
@@ -0,0 +1,120 @@
+import os
+import threading
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from . import jobs
+from .images import IMAGE_FIELDS, RENDITIONS_DIR, rendition_files
+from .thumbnails import THUMBNAILS_DIR
+
+# Удаление файлов, на которые больше не ссылается ни одна запись. В запросе файловая
+# система не трогается: имена копятся до коммита и уходят одной фоновой задачей на
+# транзакцию. Всё, что не попало в очередь (сбой между коммитом и постановкой задачи,
+# update() в обход модели), подбирает команда reap_media.
+
+# Каталоги с производными копиями: у них своя очистка (images.build_renditions, prune_thumbnails)
+DERIVED_DIRS = (RENDITIONS_DIR, THUMBNAILS_DIR)
+
+_local = threading.local()
+
+
+class _DeletionBatch:
+    def __init__(self, using):
+        self.using = using
+        self.names = set()
+
+    def __call__(self):
+        _batches().pop(self.using, None)
+        if self.names:
+            jobs.enqueue('media.delete', names=sorted(self.names))
+
+
+def _batches():
+    if not hasattr(_local, 'batches'):
+        _local.batches = {}
+    return _local.batches
+
+
+def _pending(connection, batch):
+    # Пачка ещё ждёт коммита; после отката её колбэк выброшен и пачка не годится
+    return any(func is batch for _, func, _ in connection.run_on_commit)
+
+
+def file_names(instance, field):
+    name = getattr(instance, field).name
+    if not name:
+        return []
+    names = [name]
+    renditions = getattr(instance, 'renditions', None) or {}
+    if renditions.get('source') == name:
+        names += rendition_files(renditions)
+    return names
+
+
+def queue_file_deletion(names, using=DEFAULT_DB_ALIAS):
+    names = [name for name in names if name]
+    if not names:
+        return
+    connection = connections[using]
+    batch = _batches().get(using)
+    if batch is None or not connection.in_atomic_block or not _pending(connection, batch):
+        batch = _DeletionBatch(using)
+        if connection.in_atomic_block:
+            _batches()[using] = batch
+        batch.names.update(names)
+        transaction.on_commit(batch, using=using)
+    else:
+        batch.names.update(names)
+
+
+def referenced_names(names):
+    referenced = set()
+    for model_label, field in IMAGE_FIELDS:
+        model = apps.get_model(model_label)
+        referenced.update(model.objects.filter(**{f'{field}__in': names}).values_list(field, flat=True))
+    return referenced
+
+
+@jobs.handler('media.delete')
+def delete_files(names):
+    # Тот же файл мог снова оказаться в записи (например, откат замены через админку)
+    for name in set(names) - referenced_names(names):
+        default_storage.delete(name)
+
+
+def iter_media_files(root=None):
+    # Обход в глубину через os.scandir: без построения полного списка файлов в памяти
+    root = root or settings.MEDIA_ROOT
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = os.scandir(directory)
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                name = os.path.relpath(entry.path, root).replace(os.sep, '/')
+                if entry.is_dir(follow_symlinks=False):
+                    if name not in DERIVED_DIRS:
+                        stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield name, entry.stat().st_mtime
+
+
+def find_orphans(min_age, chunk_size=500):
+    # Свежие файлы пропускаются: запись о загрузке могла ещё не закоммититься
+    cutoff = time.time() - min_age
+    chunk = []
+    for name, mtime in iter_media_files():
+        if mtime < cutoff:
+            chunk.append(name)
+        if len(chunk) >= chunk_size:
+            yield from set(chunk) - referenced_names(chunk)
+            chunk = []
+    if chunk:
+        yield from set(chunk) - referenced_names(chunk)
@@ -0,0 +1,186 @@
+from operator import attrgetter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from . import realtime
+from .models import Conversation, Message
+
+CONVERSATIONS_PER_PAGE = 30
+MESSAGES_PER_PAGE = 50
+MESSAGES_SINCE_LIMIT = 200
+UNREAD_CACHE_TIMEOUT = 60 * 10
+
+
+def _touch_conversation(user_id, contact_id, message, unread):
+    changes = {
+        'last_message': message,
+        'last_message_at': message.timestamp,
+        'unread_count': F('unread_count') + unread,
+    }
+    conversations = Conversation.objects.filter(user_id=user_id, contact_id=contact_id)
+    if conversations.update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            Conversation.objects.create(user_id=user_id, contact_id=contact_id, last_message=message,
+                                        last_message_at=message.timestamp, unread_count=unread)
+    except IntegrityError:
+        # Строку успел создать параллельный запрос
+        conversations.update(**changes)
+
+
+def record_message(message):
+    _touch_conversation(message.sender_id, message.recipient_id, message, unread=0)
+    _touch_conversation(message.recipient_id, message.sender_id, message, unread=1)
+    transaction.on_commit(lambda: _message_committed(message))
+
+
+def _message_committed(message):
+    _change_cached_unread(message.recipient_id, 1)
+    # Открытые вкладки собеседников получают сообщение и новый счётчик без перезагрузки
+    realtime.publish_message(message)
+    realtime.publish_unread(message.recipient_id, get_unread_count(message.recipient))
+
+
+def unread_messages(user, contact, last_read_id):
+    # Непрочитанные - сообщения собеседника после водяного знака: диапазон индекса message_pair_idx
+    return Message.objects.filter(sender=contact, recipient=user, id__gt=last_read_id)
+
+
+def mark_conversation_read(user, contact, up_to=None):
+    # Прочтение - одна строка Conversation, сколько бы сообщений ни накопилось.
+    # Без up_to переписка читается до последнего сообщения
+    conversations = Conversation.objects.filter(user=user, contact=contact)
+    row = conversations.values_list('last_read_id', 'last_message_id').first()
+    if row is None:
+        return 0
+    last_read_id, last_message_id = row
+    last_message_id = last_message_id or 0
+    if up_to is None or up_to > last_message_id:
+        up_to = last_message_id
+    if up_to <= last_read_id:
+        # Уже прочитано - ничего не пишем
+        return last_read_id
+
+    # Счётчик пересчитывается тем же UPDATE, поэтому сообщение, пришедшее параллельно,
+    # не пропадёт из непрочитанных; водяной знак только растёт
+    remaining = (unread_messages(user, contact, up_to).order_by().values('recipient')
+                 .annotate(count=Count('id')).values('count'))
+    conversations.filter(last_read_id__lt=up_to).update(last_read_id=up_to,
+                                                        unread_count=Coalesce(Subquery(remaining), 0))
+    transaction.on_commit(lambda: _conversations_read(user, {contact.id: up_to}))
+    return up_to
+
+
+def mark_all_read(user):
+    # Все переписки пользователя одним UPDATE: водяной знак на последнее сообщение каждой
+    conversations = Conversation.objects.filter(user=user, unread_count__gt=0, last_message_id__gt=F('last_read_id'))
+    watermarks = dict(conversations.values_list('contact_id', 'last_message_id'))
+    if not watermarks:
+        return 0
+    updated = conversations.update(last_read_id=F('last_message_id'), unread_count=0)
+    transaction.on_commit(lambda: _conversations_read(user, watermarks))
+    return updated
+
+
+def _conversations_read(user, watermarks):
+    _unread_cache().delete(_unread_cache_key(user.id))
+    realtime.publish_unread(user.id, get_unread_count(user))
+    # Отметки о прочтении у собеседников
+    for contact_id, last_read_id in watermarks.items():
+        realtime.publish_read(contact_id, user.id, last_read_id)
+
+
+def read_receipt(user, contact):
+    # До какого сообщения собеседник прочитал переписку с пользователем
+    watermark = Conversation.objects.filter(user=contact, contact=user).values_list('last_read_id', flat=True).first()
+    return watermark or 0
+
+
+def inbox_queryset(user):
+    return (Conversation.objects
+            .filter(user=user)
+            .select_related('contact__profile')
+            .order_by('-last_message_at', '-id'))
+
+
+def conversation_directions(user, contact, **filters):
+    # По запросу на каждое направление: каждый читает диапазон индекса message_pair_idx
+    # (sender, recipient, id), а OR по двум парам заставил бы сортировать всю переписку
+    pairs = {(user.id, contact.id), (contact.id, user.id)}
+    return [Message.objects.filter(sender_id=sender_id, recipient_id=recipient_id, **filters)
+            for sender_id, recipient_id in pairs]
+
+
+def _merge_directions(querysets, ordering, limit):
+    items = []
+    for queryset in querysets:
+        items.extend(queryset.order_by(ordering)[:limit + 1])
+    items.sort(key=attrgetter('id'), reverse=ordering.startswith('-'))
+    return items[:limit], len(items) > limit
+
+
+def conversation_page(user, contact, before=None, page_size=MESSAGES_PER_PAGE):
+    # Последние page_size сообщений (или предшествующие before) в порядке отправки
+    filters = {'id__lt': before} if before is not None else {}
+    querysets = [queryset.select_related('sender__profile')
+                 for queryset in conversation_directions(user, contact, **filters)]
+    items, has_more = _merge_directions(querysets, '-id', page_size)
+    items.reverse()
+    return items, has_more
+
+
+def messages_since(user, contact, since, limit=MESSAGES_SINCE_LIMIT):
+    querysets = [queryset.only('id', 'sender', 'content', 'timestamp')
+                 for queryset in conversation_directions(user, contact, id__gt=since)]
+    return _merge_directions(querysets, 'id', limit)
+
+
+def message_json(message):
+    return {
+        'id': message.id,
+        'sender_id': message.sender_id,
+        'content': message.content,
+        'timestamp': message.timestamp.isoformat(),
+    }
+
+
+def total_unread(user):
+    total = Conversation.objects.filter(user=user).aggregate(total=Sum('unread_count'))['total']
+    return total or 0
+
+
+# Счётчик непрочитанных для значка в шапке хранится в кеше (бэкенд задаётся
+# настройкой UNREAD_COUNT_CACHE) и поддерживается инкрементально
+def _unread_cache():
+    return caches[getattr(settings, 'UNREAD_COUNT_CACHE', 'default')]
+
+
+def _unread_cache_key(user_id):
+    return f'unread_messages:{user_id}'
+
+
+def _change_cached_unread(user_id, delta):
+    cache = _unread_cache()
+    key = _unread_cache_key(user_id)
+    try:
+        value = cache.incr(key, delta)
+    except ValueError:
+        # Значения в кеше нет - оно будет посчитано при следующем чтении
+        return
+    if value < 0:
+        cache.delete(key)
+
+
+def get_unread_count(user):
+    cache = _unread_cache()
+    key = _unread_cache_key(user.id)
+    count = cache.get(key)
+    if count is None:
+        count = total_unread(user)
+        cache.set(key, count, UNREAD_CACHE_TIMEOUT)
+    return count
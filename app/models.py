@@ -1,43 +1,93 @@
 from django.db import models
 from django.contrib.auth.models import User
-from PIL import Image
-import os
+from django.utils import timezone
 
-class Post(models.Model):
+
+def _fields_to_save(instance, excluded):
+    deferred = instance.get_deferred_fields()
+    return [
+        field.name for field in instance._meta.concrete_fields
+        if not field.primary_key
+        and field.name not in excluded
+        and field.attname not in deferred
+    ]
+
+
+class CounterFieldsMixin:
+    # Счётчики меняются только через F()-обновления, поэтому обычный save()
+    # существующей записи не должен перезаписывать их устаревшими значениями
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and self.pk and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = _fields_to_save(self, self.counter_fields)
+        super().save(*args, **kwargs)
+
+
+class LoadedFilesMixin:
+    # Имена файлов в том виде, в каком запись загружена из БД: по ним сигнал
+    # после save() видит замену файла без повторного SELECT (см. app/media_cleanup.py)
+    file_fields = ()
+    # Копии изображений пишет только фоновая задача (images.build_renditions) через update():
+    # save() существующей записи их не трогает, даже если поле названо в update_fields
+    derived_fields = ('renditions',)
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and self.pk:
+            update_fields = kwargs.get('update_fields')
+            if update_fields is None:
+                # Заодно и счётчики, если у модели есть CounterFieldsMixin
+                update_fields = _fields_to_save(self, getattr(self, 'counter_fields', ()))
+            kwargs['update_fields'] = [name for name in update_fields if name not in self.derived_fields]
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_files = {
+            name: instance.__dict__[name] for name in cls.file_fields if name in instance.__dict__
+        }
+        return instance
+
+
+class Post(LoadedFilesMixin, CounterFieldsMixin, models.Model):
     title = models.CharField(max_length=200)
     content = models.TextField()
     author = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     image = models.ImageField(upload_to="post_images/", blank=True, null=True) # blank=True не позволяет заполнять поле
+    # Денормализованные счётчики, обновляются сигналами в app/signals.py
+    like_count = models.PositiveIntegerField(default=0, editable=False)
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+    favorite_count = models.PositiveIntegerField(default=0, editable=False)
+    renditions = models.JSONField(default=dict, blank=True, editable=False)
+
+    counter_fields = ('like_count', 'comment_count', 'favorite_count')
+    file_fields = ('image',)
 
     def __str__(self):
         return self.title
 
     def get_like_count(self):
-        return self.likes.count()
+        return self.like_count
 
     def get_comment_count(self):
-        return self.comments.count()
+        return self.comment_count
 
     def user_is_like(self, user):
+        # Флаг, уже загруженный для этого читателя (app/viewer_state.py), без запроса
+        if hasattr(self, 'viewer_liked') and self.viewer_id == user.id:
+            return self.viewer_liked
         return self.likes.filter(user=user).exists()
 
     class Meta:
         verbose_name = 'Post'
         verbose_name_plural = 'Posts'
-
-    def delete(self, *args, **kwargs):
-        if self.image and os.path.isfile(self.image.path):
-            os.remove(self.image.path)
-        super().delete(*args, **kwargs)
-
-    def save(self, *args, **kwargs):
-        if self.pk:
-            old_post = Post.objects.get(pk=self.pk)
-            if old_post.image and old_post.image != self.image:
-                if os.path.isfile(old_post.image.path):
-                    os.remove(old_post.image.path)
-        super().save(*args, **kwargs)
+        indexes = [
+            # Лента и "мои посты" листаются по ключу (created_at, id), см. app/feed.py
+            models.Index(fields=['created_at', 'id'], name='post_feed_idx'),
+            models.Index(fields=['author', 'created_at', 'id'], name='post_author_feed_idx'),
+        ]
 
 
 class Like(models.Model):
@@ -53,19 +103,58 @@ class Like(models.Model):
     def __str__(self):
         return f"{self.user.username} liked {self.post.title}"
 
-class Comment(models.Model):
+# Материализованный путь комментария: id всех предков и самого комментария
+# в base36 фиксированной ширины. Сортировка по path даёт порядок отображения дерева.
+COMMENT_PATH_STEP = 8
+COMMENT_MAX_DEPTH = 30
+BASE36 = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+def comment_path_segment(pk):
+    segment = ''
+    while pk:
+        pk, rest = divmod(pk, 36)
+        segment = BASE36[rest] + segment
+    return segment.rjust(COMMENT_PATH_STEP, '0')
+
+class Comment(CounterFieldsMixin, models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comments')
     author = models.ForeignKey(User, on_delete=models.CASCADE)
     content = models.TextField()
     create_at = models.DateTimeField(auto_now_add=True)
     parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='replies')
+    like_count = models.PositiveIntegerField(default=0, editable=False)
+    path = models.CharField(max_length=255, blank=True, editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+
+    counter_fields = ('like_count',)
 
     def __str__(self):
         return f"Comment by {self.author.username} on {self.post.title}"
 
+    @property
+    def thread_path(self):
+        return self.path[:COMMENT_PATH_STEP]
+
+    def save(self, *args, **kwargs):
+        creating = self._state.adding
+        if creating and self.parent_id and self.parent.depth >= COMMENT_MAX_DEPTH:
+            # Слишком глубокая ветка - ответ становится соседом родителя
+            self.parent = self.parent.parent
+        super().save(*args, **kwargs)
+        if creating and not self.path:
+            # path зависит от собственного id, поэтому дописывается после INSERT
+            prefix = self.parent.path if self.parent_id else ''
+            self.path = prefix + comment_path_segment(self.pk)
+            self.depth = self.parent.depth + 1 if self.parent_id else 0
+            Comment.objects.filter(pk=self.pk).update(path=self.path, depth=self.depth)
+
     class Meta:
         verbose_name = 'Comment',
         verbose_name_plural = 'Comments'
+        indexes = [
+            models.Index(fields=['post', 'path'], name='comment_post_path_idx'),
+            models.Index(fields=['post', 'depth', 'path'], name='comment_post_threads_idx'),
+        ]
 
 class CommentLike(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="comment_likes")
@@ -80,27 +169,86 @@ class CommentLike(models.Model):
     def __str__(self):
         return f"{self.user.username} liked comment on {self.comment.post.title}"
 
-class UserProfile(models.Model):
+class UserProfile(LoadedFilesMixin, CounterFieldsMixin, models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
     avatar = models.ImageField(upload_to='avatars/', blank=True, null=True)
     birth_date = models.DateField(blank=True, null=True)
     first_name = models.CharField(max_length=30, blank=True)
     last_name = models.CharField(max_length=30, blank=True)
     bio = models.TextField(max_length=500, blank=True)
+    # Уменьшенные копии аватара, генерируются в фоне (app/images.py)
+    renditions = models.JSONField(default=dict, blank=True, editable=False)
+    # Число подписчиков, обновляется сигналами; по нему выбирается режим ленты (app/timeline.py)
+    follower_count = models.PositiveIntegerField(default=0, editable=False)
+
+    counter_fields = ('follower_count',)
+    file_fields = ('avatar',)
+
     def __str__(self):
         return f"{self.user.username}'s Profile"
 
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        if self.avatar:
-            img = Image.open(self.avatar.path)
-            if img.height > 300 or img.width > 300:
-                output_size = (300, 300)
-                img.thumbnail(output_size)
-                img.save(self.avatar.path)
     class Meta:
         verbose_name = 'UserProfile'
         verbose_name_plural = "UserProfile's"
+        indexes = [
+            # Популярные авторы, чьи посты подмешиваются в ленту при чтении
+            models.Index(fields=['follower_count'], name='profile_follower_count_idx'),
+        ]
+
+# Подписка follower на посты author
+class Follow(models.Model):
+    follower = models.ForeignKey(User, on_delete=models.CASCADE, related_name='following')
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='followers')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('follower', 'author')
+        verbose_name = 'Follow'
+        verbose_name_plural = 'Follows'
+        indexes = [
+            # Подписчики автора пачками по id при раскладке поста
+            models.Index(fields=['author', 'id'], name='follow_author_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.follower.username} подписан на {self.author.username}"
+
+# Готовая лента пользователя: строка на каждый пост автора, на которого он подписан.
+# Заполняется фоновой задачей при публикации поста (app/timeline.py)
+class TimelineEntry(models.Model):
+    # Отдельный индекс по user не нужен: его даёт уникальный (user, post)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+', db_index=False)
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='+')
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    # "Горячесть" поста (timeline.hot_score), пересчитывается командой rescore_timeline
+    score = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = ('user', 'post')
+        verbose_name = 'TimelineEntry'
+        verbose_name_plural = 'TimelineEntries'
+        indexes = [
+            # Страница ленты - диапазон этого индекса: user = X AND (score, post_id) < курсор
+            models.Index(fields=['user', '-score', '-post'], name='timeline_user_score_idx'),
+            # Отписка убирает посты автора из ленты
+            models.Index(fields=['user', 'author'], name='timeline_user_author_idx'),
+        ]
+
+# Активность поста за час: лайки, комментарии и избранное с весами (app/trending.py).
+# Обновляется при каждом действии, старые часы удаляет compact_trending
+class TrendingBucket(models.Model):
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='+')
+    bucket = models.DateTimeField()
+    points = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('post', 'bucket')
+        verbose_name = 'TrendingBucket'
+        verbose_name_plural = 'TrendingBuckets'
+        indexes = [
+            # Подсчёт рейтинга читает только часы из окна
+            models.Index(fields=['bucket'], name='trending_bucket_idx'),
+        ]
 
 class Favorite(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='favorite_posts')
@@ -112,6 +260,9 @@ class Favorite(models.Model):
         verbose_name = 'Favorite'
         verbose_name_plural = 'Favorites'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='favorite_user_recent_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username}'favorite {self.post.title}"
@@ -123,6 +274,8 @@ class Message(models.Model):
     subject = models.CharField(max_length=200, blank=True)
     content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
+    # Прежняя отметка прочтения: больше не пишется, нужна только rebuild_conversations для
+    # переноса в Conversation.last_read_id. Удалить отдельным изменением после переноса
     is_read = models.BooleanField(default=False)
 
     def __str__(self):
@@ -132,6 +285,34 @@ class Message(models.Model):
         verbose_name = "Message"
         verbose_name_plural = "Messages"
         ordering = ["-timestamp"]
+        indexes = [
+            # Переписка пары: по запросу на направление, страницы по id (app/messaging.py).
+            # Он же даёт непрочитанные - диапазон id после водяного знака Conversation.last_read_id
+            models.Index(fields=['sender', 'recipient', 'id'], name='message_pair_idx'),
+        ]
+
+# Сводка переписки для списка диалогов: по строке на каждого участника пары,
+# обновляется при отправке сообщения и при прочтении (см. app/messaging.py)
+class Conversation(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="conversations")
+    contact = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    last_message = models.ForeignKey(Message, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    unread_count = models.PositiveIntegerField(default=0)
+    # Водяной знак прочтения: всё от contact с id не больше этого прочитано пользователем
+    last_read_id = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"Переписка {self.user.username} с {self.contact.username}"
+
+    class Meta:
+        verbose_name = "Conversation"
+        verbose_name_plural = "Conversations"
+        unique_together = ('user', 'contact')
+        ordering = ["-last_message_at"]
+        indexes = [
+            models.Index(fields=['user', '-last_message_at', '-id'], name='conversation_inbox_idx'),
+        ]
 
 # Модель для категории
 class Category(models.Model):
@@ -158,9 +339,31 @@ class Product(models.Model):
     def __str__(self):
         return self.name
 
+    # Главное изображение товара. Каталог подгружает его одним запросом на страницу
+    # (catalog.primary_image_prefetch -> primary_images), иначе берётся из self.images
+    @property
+    def primary_image(self):
+        if hasattr(self, 'primary_images'):
+            return self.primary_images[0].image if self.primary_images else None
+        images = list(self.images.all())
+        for image in images:
+            if image.is_primary and image.image:
+                return image.image
+        for image in images:
+            if image.image:
+                return image.image
+        return None
+
     class Meta:
         verbose_name = "Product"
         verbose_name_plural = "Products"
+        # По индексу на каждую сортировку каталога (app/catalog.py), общий и внутри категории
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='product_recent_idx'),
+            models.Index(fields=['category', '-created_at', '-id'], name='product_category_recent_idx'),
+            models.Index(fields=['price', 'id'], name='product_price_idx'),
+            models.Index(fields=['category', 'price', 'id'], name='product_category_price_idx'),
+        ]
 
 # Оплата
 class Order(models.Model):
@@ -185,11 +388,14 @@ class Order(models.Model):
         verbose_name = 'Order'
         verbose_name_plural = 'Orders'
 
-class ProductImage(models.Model):
+class ProductImage(LoadedFilesMixin, models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="images")
     image = models.ImageField(upload_to="product_images/", blank=True, null=True)
     is_primary = models.BooleanField(default=False)
     order = models.PositiveIntegerField(default=0)
+    renditions = models.JSONField(default=dict, blank=True, editable=False)
+
+    file_fields = ('image',)
 
     def __str__(self):
         return f"Изображение {self.id} для {self.product.name}"
@@ -199,11 +405,33 @@ class ProductImage(models.Model):
         verbose_name_plural = "ProductImages"
         ordering = ['order']
 
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        if self.image:
-            img = Image.open(self.image.path)
-            if img.height > 800 or img.width > 800:
-                output_size = (800, 800)
-                img.thumbnail(output_size)
-                img.save(self.image.path)
\ No newline at end of file
+# Фоновые задачи: очередь в БД, которую разбирает команда run_jobs (см. app/jobs.py)
+class Job(models.Model):
+    STATUS_CHOICES = [
+        ("pending", "в очереди"),
+        ("running", "выполняется"),
+        ("done", "выполнено"),
+        ("failed", "ошибка"),
+    ]
+
+    kind = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    locked_by = models.CharField(max_length=64, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # Раньше этого времени задача не берётся: отсрочка повтора после ошибки
+    run_after = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Задача #{self.id} {self.kind} ({self.status})"
+
+    class Meta:
+        verbose_name = 'Job'
+        verbose_name_plural = 'Jobs'
+        indexes = [
+            models.Index(fields=['status', 'id'], name='job_queue_idx'),
+        ]
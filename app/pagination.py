@@ -0,0 +1,90 @@
+import base64
+import datetime
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+# Keyset (курсорная) пагинация: страница выбирается условием по ключу сортировки,
+# а не OFFSET, поэтому стоимость запроса не растёт с номером страницы.
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    # DjangoJSONEncoder обрезает время до миллисекунд, а для курсора нужна полная точность
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class KeysetPage:
+    def __init__(self, items, next_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def encode_cursor(values):
+    raw = json.dumps(values, cls=CursorEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(model, ordering, cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidCursor(cursor)
+    if not isinstance(values, list) or len(values) != len(ordering):
+        raise InvalidCursor(cursor)
+    decoded = []
+    for name, value in zip(ordering, values):
+        field = model._meta.get_field(name.lstrip('-'))
+        try:
+            decoded.append(field.to_python(value))
+        except Exception:
+            raise InvalidCursor(cursor)
+    return decoded
+
+
+def keyset_filter(ordering, values):
+    # (a, b) > (x, y)  ==>  a > x OR (a = x AND b > y)
+    condition = Q()
+    equal = {}
+    for name, value in zip(ordering, values):
+        field = name.lstrip('-')
+        lookup = 'lt' if name.startswith('-') else 'gt'
+        condition |= Q(**equal, **{f'{field}__{lookup}': value})
+        equal[field] = value
+    return condition
+
+
+def keyset_page(queryset, ordering, cursor=None, page_size=20):
+    ordering = tuple(ordering)
+    queryset = queryset.order_by(*ordering)
+    if cursor:
+        values = decode_cursor(queryset.model, ordering, cursor)
+        queryset = queryset.filter(keyset_filter(ordering, values))
+
+    # Берём на одну запись больше, чтобы узнать, есть ли следующая страница
+    items = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        last = items[-1]
+        attnames = [queryset.model._meta.get_field(name.lstrip('-')).attname for name in ordering]
+        next_cursor = encode_cursor([getattr(last, attname) for attname in attnames])
+    return KeysetPage(items, next_cursor)
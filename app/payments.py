@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import re
+
+import httpx
+from django.conf import settings
+from django.db.models import Q
+
+from .models import Order
+
+logger = logging.getLogger(__name__)
+
+# Асинхронный клиент API ЮKassa. Запрос к платёжке не держит поток воркера: под ASGI
+# (BLOG/asgi.py) ожидание ответа - это просто await в цикле событий.
+# Повторы безопасны: у каждого запроса на создание свой Idempotence-Key, и ЮKassa
+# возвращает уже созданный платёж вместо нового.
+
+PAYMENT_TIMEOUT = httpx.Timeout(10.0, connect=3.0)
+PAYMENT_RETRIES = 3
+PAYMENT_RETRY_DELAY = 0.5
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# id платежа подставляется в путь запроса к API - только буквы, цифры, "_" и "-"
+PAYMENT_ID_RE = re.compile(r'[\w-]+', re.ASCII)
+
+# Статус платежа ЮKassa -> статус заказа
+PAYMENT_STATUSES = {
+    'succeeded': 'paid',
+    'canceled': 'cancelled',
+}
+
+
+class PaymentError(Exception):
+    pass
+
+
+def _api_url():
+    return getattr(settings, 'YOOKASSA_API_URL', 'https://api.yookassa.ru/v3').rstrip('/')
+
+
+def payment_client():
+    # Общий клиент для пачки запросов (сверка заказов): соединения переиспользуются
+    auth = (str(settings.YOOKASSA_SHOP_ID), settings.YOOKASSA_SECRET_KEY)
+    return httpx.AsyncClient(base_url=_api_url(), auth=auth, timeout=PAYMENT_TIMEOUT)
+
+
+async def _request(method, path, json=None, idempotence_key=None, client=None):
+    if client is None:
+        async with payment_client() as client:
+            return await _request(method, path, json, idempotence_key, client)
+
+    headers = {'Idempotence-Key': idempotence_key} if idempotence_key else {}
+    for attempt in range(PAYMENT_RETRIES):
+        try:
+            response = await client.request(method, path, json=json, headers=headers)
+        except httpx.TransportError as exc:
+            error = exc
+        else:
+            if response.status_code not in RETRY_STATUSES:
+                if response.is_error:
+                    raise PaymentError(f"ЮKassa ответила {response.status_code}: {response.text[:200]}")
+                return response.json()
+            error = PaymentError(f"ЮKassa ответила {response.status_code}")
+        logger.warning("Запрос %s %s к ЮKassa, попытка %s: %s", method, path, attempt + 1, error)
+        if attempt + 1 < PAYMENT_RETRIES:
+            await asyncio.sleep(PAYMENT_RETRY_DELAY * 2 ** attempt)
+    raise PaymentError(f"ЮKassa недоступна: {error}")
+
+
+async def create_payment(order, product, return_url):
+    return await _request('POST', '/payments', idempotence_key=f'order-{order.id}', json={
+        'amount': {
+            'value': str(order.total_price),
+            'currency': 'RUB',
+        },
+        'confirmation': {
+            'type': 'redirect',
+            'return_url': return_url,
+        },
+        'capture': True,
+        'description': f"Покупка {product.name}",
+        'metadata': {
+            'order_id': order.id,
+        },
+    })
+
+
+def is_payment_id(value):
+    return isinstance(value, str) and PAYMENT_ID_RE.fullmatch(value) is not None
+
+
+async def get_payment(payment_id, client=None):
+    if not is_payment_id(payment_id):
+        raise ValueError(f"Некорректный id платежа: {payment_id!r}")
+    return await _request('GET', f'/payments/{payment_id}', client=client)
+
+
+async def apply_payment(payment):
+    # Условный UPDATE: меняется только заказ в ожидании с этим платежом, поэтому повторное
+    # или запоздалое уведомление ничего не перезапишет
+    status = PAYMENT_STATUSES.get(payment.get('status'))
+    order_id = (payment.get('metadata') or {}).get('order_id')
+    if status is None or order_id is None:
+        return 0
+    # id платежа у заказа может быть ещё не записан, если уведомление обогнало checkout
+    return await Order.objects.filter(
+        Q(yookassa_payment_id=payment['id']) | Q(yookassa_payment_id__isnull=True),
+        pk=order_id, status='pending',
+    ).aupdate(status=status, yookassa_payment_id=payment['id'])
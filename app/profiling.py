@@ -0,0 +1,226 @@
+import logging
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import ContextDecorator
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.backends.django import DjangoTemplates
+from django.test.utils import CaptureQueriesContext
+
+logger = logging.getLogger(__name__)
+
+# Профилирование запросов: число SQL-запросов, время в БД, повторы одного и того же
+# запроса и время рендера шаблонов. Итог уходит в заголовок Server-Timing и в скользящую
+# статистику по имени URL (view profiling_stats). Включается настройкой PROFILING_ENABLED.
+
+PROFILING_SAMPLES = 500
+# Один и тот же SQL (с разными параметрами) чаще этого - похоже на N+1
+PROFILING_SIMILAR_THRESHOLD = 5
+
+_current = ContextVar('request_profile', default=None)
+
+
+class RequestProfile:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.statements = Counter()  # (sql, params) -> сколько раз
+        self.templates = Counter()   # sql без параметров -> сколько раз
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+            self.statements[(sql, repr(params))] += 1
+            self.templates[sql] += 1
+
+    @property
+    def duplicates(self):
+        return sum(count - 1 for count in self.statements.values() if count > 1)
+
+    @property
+    def similar(self):
+        return {sql: count for sql, count in self.templates.items() if count >= PROFILING_SIMILAR_THRESHOLD}
+
+
+# Обёртка ставится на соединение один раз и пишет в профиль текущего запроса из ContextVar:
+# так учитываются и запросы асинхронных представлений, которые ORM выполняет в других потоках
+def _record_query(execute, sql, params, many, context):
+    profile = _current.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    return profile(execute, sql, params, many, context)
+
+
+def _install_wrapper(connection):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+def _connection_created(sender, connection, **kwargs):
+    _install_wrapper(connection)
+
+
+connection_created.connect(_connection_created, dispatch_uid='app.profiling')
+
+
+class ProfiledTemplate:
+    def __init__(self, wrapped):
+        self._wrapped = wrapped
+
+    def __getattr__(self, name):
+        return getattr(self._wrapped, name)
+
+    def render(self, context=None, request=None):
+        profile = _current.get()
+        if profile is None:
+            return self._wrapped.render(context, request)
+        # render_to_string внутри другого рендера не считается дважды
+        profile.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return self._wrapped.render(context, request)
+        finally:
+            profile.template_depth -= 1
+            if not profile.template_depth:
+                profile.template_time += time.perf_counter() - start
+
+
+# Бэкенд шаблонов, который засекает время рендера; подключается в TEMPLATES['BACKEND']
+class ProfiledTemplates(DjangoTemplates):
+    def from_string(self, template_code):
+        return ProfiledTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return ProfiledTemplate(super().get_template(template_name))
+
+
+class _Stats:
+    def __init__(self, samples=PROFILING_SAMPLES):
+        self._lock = threading.Lock()
+        self._samples = defaultdict(lambda: deque(maxlen=samples))
+
+    def add(self, name, total, db_time, queries):
+        with self._lock:
+            self._samples[name].append((total, db_time, queries))
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+
+    def summary(self):
+        with self._lock:
+            snapshot = {name: list(samples) for name, samples in self._samples.items()}
+        result = {}
+        for name, samples in sorted(snapshot.items()):
+            result[name] = {'count': len(samples)}
+            for index, metric in enumerate(('total_ms', 'db_ms', 'queries')):
+                values = sorted(sample[index] for sample in samples)
+                result[name][metric] = {'p50': percentile(values, 50), 'p95': percentile(values, 95)}
+        return result
+
+
+def percentile(values, percent):
+    if not values:
+        return None
+    position = min(len(values) - 1, round(percent / 100 * (len(values) - 1)))
+    return round(values[position], 2)
+
+
+stats = _Stats()
+
+
+def _server_timing(profile, total):
+    return ', '.join([
+        f'db;dur={profile.db_time * 1000:.1f};desc="{profile.queries} queries"',
+        f'dup;desc="{profile.duplicates} duplicate queries"',
+        f'tpl;dur={profile.template_time * 1000:.1f}',
+        f'total;dur={total * 1000:.1f}',
+    ])
+
+
+class ProfilingMiddleware:
+    # Поддерживает и синхронную, и асинхронную цепочку: под ASGI асинхронные
+    # представления не переводятся из-за этого middleware в поток
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PROFILING_ENABLED', settings.DEBUG):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        _install_wrapper(connections['default'])
+        profile = RequestProfile()
+        token = _current.set(profile)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, profile, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        profile = RequestProfile()
+        token = _current.set(profile)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, profile, time.perf_counter() - start)
+
+    def _finish(self, request, response, profile, total):
+        response['Server-Timing'] = _server_timing(profile, total)
+        match = request.resolver_match
+        name = match.view_name if match else 'unresolved'
+        stats.add(name, total * 1000, profile.db_time * 1000, profile.queries)
+        for sql, count in profile.similar.items():
+            logger.warning("%s: запрос выполнен %s раз (возможен N+1): %s", name, count, sql[:200])
+        return response
+
+
+def current_profile():
+    return _current.get()
+
+
+# Бюджет запросов для тестов и отладки:
+#     with assert_max_queries(5): client.get('/')
+#     @assert_max_queries(3)
+#     def test_home(self): ...
+class assert_max_queries(ContextDecorator):
+    def __init__(self, limit, using='default'):
+        self.limit = limit
+        self.using = using
+
+    def __enter__(self):
+        self.context = CaptureQueriesContext(connections[self.using])
+        self.context.__enter__()
+        return self.context
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.context.__exit__(exc_type, exc_value, traceback)
+        if exc_type is not None:
+            return False
+        executed = len(self.context)
+        if executed > self.limit:
+            queries = '\n'.join(f"{number}. {query['sql']}"
+                                for number, query in enumerate(self.context.captured_queries, start=1))
+            raise AssertionError(f"Выполнено {executed} запросов при бюджете {self.limit}:\n{queries}")
+        return False
@@ -0,0 +1,47 @@
+from django.db import IntegrityError, transaction
+
+from . import like_buffer
+from .models import Post, Like, Favorite
+
+# Лайки и избранное: одна вставка или удаление строки реакции и новое значение счётчика.
+# Счётчик поста и очки "Популярного" меняют сигналы (app/signals.py) в той же транзакции.
+# Желаемое состояние можно передать явно (state=1/0): повторный клик или повтор запроса
+# после обрыва соединения тогда ничего не меняет, в отличие от переключения.
+
+REACTIONS = {
+    'like': (Like, 'like_count'),
+    'favorite': (Favorite, 'favorite_count'),
+}
+
+
+def parse_state(value):
+    return {'1': True, '0': False}.get(value)
+
+
+def _insert(model, user, post):
+    try:
+        # Точка сохранения: параллельный запрос мог уже вставить ту же строку
+        with transaction.atomic():
+            model.objects.create(user=user, post=post)
+    except IntegrityError:
+        pass
+
+
+def set_reaction(user, post, kind, active=None):
+    if kind == 'like' and like_buffer.enabled():
+        # Отложенная запись: лайк попадает в журнал процесса и пишется в БД пачкой
+        return like_buffer.set_like(user, post, active)
+    model, field = REACTIONS[kind]
+    reactions = model.objects.filter(user=user, post=post)
+    with transaction.atomic():
+        if active is None:
+            # Переключение: удаляем, а если удалять нечего - вставляем
+            active = not reactions.delete()[0]
+            if active:
+                _insert(model, user, post)
+        elif active:
+            _insert(model, user, post)
+        else:
+            reactions.delete()
+        count = Post.objects.filter(pk=post.pk).values_list(field, flat=True).get()
+    return active, count
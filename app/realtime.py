@@ -0,0 +1,243 @@
+import asyncio
+import io
+import json
+import logging
+import threading
+from importlib import import_module
+from urllib.parse import urlsplit
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.core.exceptions import DisallowedHost, ObjectDoesNotExist
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+from .models import Message
+from .thumbnails import thumbnail_url
+
+logger = logging.getLogger(__name__)
+
+# Новые сообщения и счётчик непрочитанных приходят в браузер по Server-Sent Events.
+# Поток обслуживает не Django-представление, а отдельное ASGI-приложение перед Django
+# (BLOG/asgi.py): обработчик Django держит на каждый запрос свой поток с соединением к БД,
+# а открытое соединение EventSource - это только задача в цикле событий и очередь.
+#
+# События рассылает брокер (настройка REALTIME_BACKEND). InProcessBroker доставляет их
+# подписчикам своего процесса; при нескольких процессах/серверах нужен брокер с тем же
+# интерфейсом (publish/subscribe/unsubscribe) поверх общей шины, например Redis pub/sub.
+
+REALTIME_STREAM_PATH = '/messages/stream'
+REALTIME_HEARTBEAT = 25          # комментарий-пинг, чтобы прокси не закрывали соединение
+REALTIME_RETRY_MS = 3000
+REALTIME_QUEUE_SIZE = 100
+REALTIME_REPLAY_LIMIT = 50
+
+
+class InProcessBroker:
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id):
+        queue = asyncio.Queue(REALTIME_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.setdefault(user_id, {})[queue] = asyncio.get_running_loop()
+        return queue
+
+    def unsubscribe(self, user_id, queue):
+        with self._lock:
+            queues = self._subscribers.get(user_id, {})
+            queues.pop(queue, None)
+            if not queues:
+                self._subscribers.pop(user_id, None)
+
+    def publish(self, user_id, event):
+        # Вызывается из любого потока (on_commit в синхронном представлении):
+        # событие передаётся в цикл событий подписчика
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, {}).items())
+        for queue, loop in subscribers:
+            try:
+                loop.call_soon_threadsafe(_deliver, queue, event)
+            except RuntimeError:
+                # Цикл событий уже закрыт
+                pass
+
+    def connections(self):
+        with self._lock:
+            return sum(len(queues) for queues in self._subscribers.values())
+
+
+def _deliver(queue, event):
+    if queue.full():
+        # Клиент не успевает читать: вместо пропуска событий просим его перезагрузить данные
+        while not queue.empty():
+            queue.get_nowait()
+        event = {'event': 'resync', 'data': {}}
+    queue.put_nowait(event)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(getattr(settings, 'REALTIME_BACKEND', 'app.realtime.InProcessBroker'))()
+        return _broker
+
+
+def publish(user_id, event, data, event_id=None):
+    get_broker().publish(user_id, {'event': event, 'data': data, 'id': event_id})
+
+
+def message_payload(message):
+    try:
+        avatar = message.sender.profile.avatar
+    except ObjectDoesNotExist:
+        avatar = None
+    return {
+        'id': message.id,
+        'sender_id': message.sender_id,
+        'recipient_id': message.recipient_id,
+        'sender': message.sender.username,
+        'avatar': thumbnail_url(avatar, (30, 30), crop=True) if avatar else None,
+        'content': message.content,
+        'timestamp': message.timestamp.isoformat(),
+    }
+
+
+def publish_message(message):
+    data = message_payload(message)
+    # Отправителю тоже: у него могут быть открыты другие вкладки
+    for user_id in {message.sender_id, message.recipient_id}:
+        publish(user_id, 'message', data, event_id=message.id)
+
+
+def publish_unread(user_id, count):
+    publish(user_id, 'unread', {'count': count})
+
+
+def publish_read(user_id, reader_id, last_read_id):
+    publish(user_id, 'read', {'reader_id': reader_id, 'last_read_id': last_read_id})
+
+
+def format_event(event):
+    lines = []
+    if event.get('id'):
+        lines.append(f"id: {event['id']}")
+    lines.append(f"event: {event['event']}")
+    lines.append(f"data: {json.dumps(event['data'], ensure_ascii=False)}")
+    return ('\n'.join(lines) + '\n\n').encode()
+
+
+def _same_origin(request):
+    origin = request.headers.get('Origin')
+    return origin is None or urlsplit(origin).netloc == request.get_host()
+
+
+def _authenticate(scope):
+    # Синхронная часть: сессия и пользователь, как в SessionMiddleware/AuthenticationMiddleware.
+    # Соединение с БД закрывается сразу, поток не держит его на время подписки
+    close_old_connections()
+    try:
+        request = ASGIRequest(scope, io.BytesIO())
+        # Host не из ALLOWED_HOSTS - DisallowedHost, как в обычном запросе Django
+        request.get_host()
+        if not _same_origin(request):
+            return None, None
+        engine = import_module(settings.SESSION_ENGINE)
+        request.session = engine.SessionStore(request.COOKIES.get(settings.SESSION_COOKIE_NAME))
+        user = get_user(request)
+        last_event_id = request.headers.get('Last-Event-ID', '')
+        return (user.id if user.is_authenticated else None), last_event_id
+    finally:
+        close_old_connections()
+
+
+def _missed_events(user_id, last_event_id):
+    # После переподключения EventSource присылает Last-Event-ID - досылаем пропущенное
+    close_old_connections()
+    try:
+        missed = (Message.objects
+                  .filter(Q(sender_id=user_id) | Q(recipient_id=user_id), id__gt=last_event_id)
+                  .select_related('sender__profile')
+                  .order_by('id')[:REALTIME_REPLAY_LIMIT])
+        return [{'event': 'message', 'data': message_payload(message), 'id': message.id} for message in missed]
+    finally:
+        close_old_connections()
+
+
+async def _wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+async def _reject(send, status):
+    await send({'type': 'http.response.start', 'status': status, 'headers': [(b'content-type', b'text/plain')]})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def event_stream(scope, receive, send):
+    if scope['method'] != 'GET':
+        return await _reject(send, 405)
+    try:
+        user_id, last_event_id = await sync_to_async(_authenticate)(scope)
+    except DisallowedHost as error:
+        logger.warning("Поток событий: %s", error)
+        return await _reject(send, 400)
+    if user_id is None:
+        # EventSource не переподключается после ответа с ошибкой
+        return await _reject(send, 403)
+
+    broker = get_broker()
+    # Подписка до чтения пропущенного, чтобы между ними ничего не потерялось;
+    # повторы клиент отбрасывает по id
+    queue = broker.subscribe(user_id)
+    disconnected = asyncio.create_task(_wait_for_disconnect(receive))
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ]})
+        chunks = [f'retry: {REALTIME_RETRY_MS}\n\n'.encode()]
+        if last_event_id.isdigit():
+            missed = await sync_to_async(_missed_events)(user_id, int(last_event_id))
+            chunks.extend(format_event(event) for event in missed)
+        await send({'type': 'http.response.body', 'body': b''.join(chunks), 'more_body': True})
+
+        while not disconnected.done():
+            getter = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait({getter, disconnected}, timeout=REALTIME_HEARTBEAT,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if getter in done:
+                body = format_event(getter.result())
+            else:
+                getter.cancel()
+                if disconnected.done():
+                    break
+                body = b': ping\n\n'
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+    finally:
+        disconnected.cancel()
+        broker.unsubscribe(user_id, queue)
+
+
+class RealtimeMiddleware:
+    # ASGI-обёртка над приложением Django: поток событий обслуживается здесь,
+    # всё остальное уходит в Django
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] == REALTIME_STREAM_PATH:
+            return await event_stream(scope, receive, send)
+        return await self.app(scope, receive, send)
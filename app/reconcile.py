@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import time
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.utils import timezone
+
+from .models import Order
+from .payments import PAYMENT_STATUSES, PaymentError, get_payment, payment_client
+
+logger = logging.getLogger(__name__)
+
+# Сверка заказов, застрявших в "ожидании оплаты": уведомление от ЮKassa могло потеряться.
+# Заказы читаются пачками, статусы платежей запрашиваются параллельно (не больше
+# RECONCILE_CONCURRENCY запросов одновременно), а итог пачки пишется одним UPDATE на статус.
+
+RECONCILE_MIN_AGE = timedelta(minutes=15)
+RECONCILE_CHUNK_SIZE = 200
+RECONCILE_CONCURRENCY = 8
+
+
+def stale_orders(min_age=RECONCILE_MIN_AGE, chunk_size=RECONCILE_CHUNK_SIZE):
+    # Свежие заказы не трогаем: пользователь, возможно, ещё на странице оплаты
+    queryset = (Order.objects
+                .filter(status='pending', yookassa_payment_id__isnull=False,
+                        created_at__lt=timezone.now() - min_age)
+                .exclude(yookassa_payment_id='')
+                .order_by('id')
+                .values_list('id', 'yookassa_payment_id'))
+    # Пачки по id, а не один открытый курсор: между пачками таблица обновляется,
+    # а SQLite не изолирует курсор от записей в том же соединении
+    last_id = 0
+    while True:
+        chunk = list(queryset.filter(id__gt=last_id)[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1][0]
+
+
+async def fetch_payments(chunk, concurrency=RECONCILE_CONCURRENCY):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(client, payment_id):
+        async with semaphore:
+            try:
+                return await get_payment(payment_id, client=client)
+            except PaymentError as exc:
+                return exc
+
+    async with payment_client() as client:
+        payments = await asyncio.gather(*(fetch(client, payment_id) for _, payment_id in chunk))
+    return list(zip(chunk, payments))
+
+
+def apply_statuses(results, stats, dry_run=False):
+    transitions = defaultdict(list)
+    for (order_id, payment_id), payment in results:
+        if isinstance(payment, Exception):
+            logger.warning("Сверка заказа %s: %s", order_id, payment)
+            stats['failed'] += 1
+            continue
+        if str((payment.get('metadata') or {}).get('order_id')) != str(order_id):
+            logger.warning("Платёж %s не относится к заказу %s", payment_id, order_id)
+            stats['failed'] += 1
+            continue
+        status = PAYMENT_STATUSES.get(payment.get('status'))
+        if status is None:
+            stats['unchanged'] += 1
+        else:
+            transitions[status].append(order_id)
+
+    for status, ids in transitions.items():
+        if dry_run:
+            stats[status] += len(ids)
+            continue
+        # Условие на статус: заказ, который уже обновил вебхук, не перезаписывается
+        updated = Order.objects.filter(pk__in=ids, status='pending').update(status=status)
+        stats[status] += updated
+        stats['unchanged'] += len(ids) - updated
+
+
+def reconcile_orders(min_age=RECONCILE_MIN_AGE, chunk_size=RECONCILE_CHUNK_SIZE,
+                     concurrency=RECONCILE_CONCURRENCY, dry_run=False):
+    stats = Counter()
+    started = time.perf_counter()
+    for chunk in stale_orders(min_age, chunk_size):
+        stats['checked'] += len(chunk)
+        apply_statuses(asyncio.run(fetch_payments(chunk, concurrency)), stats, dry_run)
+
+    elapsed = time.perf_counter() - started
+    stats['seconds'] = round(elapsed, 2)
+    stats['per_second'] = round(stats['checked'] / elapsed, 1) if elapsed else 0
+    logger.info("Сверка заказов: %s", dict(stats))
+    return stats
@@ -0,0 +1,290 @@
+import math
+import re
+import threading
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import connection, OperationalError
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .models import Post, Comment, Product
+
+# Поиск по постам, комментариям и товарам. Индекс - SQLite FTS5, если он доступен,
+# иначе инвертированный индекс в памяти процесса. Документ индекса: (вид, id, заголовок, текст).
+
+SEARCH_RESULTS_PER_PAGE = 20
+SNIPPET_WORDS = 16
+MARK_OPEN, MARK_CLOSE = '\x02', '\x03'
+
+# Вид документа кодируется в rowid FTS-таблицы: rowid = id * KIND_SLOTS + код вида
+KINDS = {
+    'post': (1, Post),
+    'comment': (2, Comment),
+    'product': (3, Product),
+}
+KIND_SLOTS = 4
+KIND_BY_CODE = {code: kind for kind, (code, model) in KINDS.items()}
+KIND_BY_MODEL = {model: kind for kind, (code, model) in KINDS.items()}
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return TOKEN_RE.findall((text or '').lower())
+
+
+def document_for(instance):
+    if isinstance(instance, Post):
+        return instance.title, instance.content
+    if isinstance(instance, Comment):
+        return '', instance.content
+    return instance.name, instance.description
+
+
+def iter_documents(kind, chunk_size=2000):
+    model = KINDS[kind][1]
+    for instance in model.objects.order_by().iterator(chunk_size=chunk_size):
+        yield instance.pk, *document_for(instance)
+
+
+def render_snippet(text):
+    # Сначала экранируем, затем заменяем служебные маркеры на <mark>
+    return mark_safe(escape(text).replace(MARK_OPEN, '<mark>').replace(MARK_CLOSE, '</mark>'))
+
+
+class SearchHit:
+    def __init__(self, kind, object_id, score, snippet):
+        self.kind = kind
+        self.object_id = object_id
+        self.score = score
+        self.snippet = snippet
+        self.object = None
+
+
+class Fts5Backend:
+    table = 'app_search_index'
+
+    def __init__(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} "
+                f"USING fts5(title, body, tokenize='unicode61 remove_diacritics 2')"
+            )
+
+    @staticmethod
+    def _rowid(kind, object_id):
+        return object_id * KIND_SLOTS + KINDS[kind][0]
+
+    def index(self, kind, object_id, title, body):
+        rowid = self._rowid(kind, object_id)
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table} WHERE rowid = %s", [rowid])
+            cursor.execute(f"INSERT INTO {self.table} (rowid, title, body) VALUES (%s, %s, %s)",
+                           [rowid, title, body])
+
+    def remove(self, kind, object_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table} WHERE rowid = %s", [self._rowid(kind, object_id)])
+
+    def rebuild(self, chunk_size=2000):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table}")
+            for kind in KINDS:
+                batch = []
+                for object_id, title, body in iter_documents(kind, chunk_size):
+                    batch.append((self._rowid(kind, object_id), title, body))
+                    if len(batch) >= chunk_size:
+                        cursor.executemany(f"INSERT INTO {self.table} (rowid, title, body) VALUES (%s, %s, %s)", batch)
+                        batch = []
+                if batch:
+                    cursor.executemany(f"INSERT INTO {self.table} (rowid, title, body) VALUES (%s, %s, %s)", batch)
+            cursor.execute(f"INSERT INTO {self.table} ({self.table}) VALUES ('optimize')")
+
+    def search(self, terms, kind=None, limit=SEARCH_RESULTS_PER_PAGE, offset=0):
+        # Каждый термин ищется как префикс; термины состоят только из \w, кавычки безопасны
+        match = ' AND '.join(f'"{term}"*' for term in terms)
+        sql = (f"SELECT rowid, bm25({self.table}, 10.0, 1.0) AS score, "
+               f"snippet({self.table}, -1, %s, %s, '…', %s) "
+               f"FROM {self.table} WHERE {self.table} MATCH %s")
+        params = [MARK_OPEN, MARK_CLOSE, SNIPPET_WORDS, match]
+        if kind:
+            sql += f" AND rowid %% {KIND_SLOTS} = %s"
+            params.append(KINDS[kind][0])
+        sql += " ORDER BY score LIMIT %s OFFSET %s"
+        params += [limit, offset]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        return [SearchHit(KIND_BY_CODE[rowid % KIND_SLOTS], rowid // KIND_SLOTS, -score, render_snippet(snippet))
+                for rowid, score, snippet in rows]
+
+
+class MemoryBackend:
+    # Резервный индекс для баз без FTS5: живёт в памяти процесса и строится при первом поиске
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._postings = defaultdict(dict)  # термин -> {(вид, id): частота}
+        self._documents = {}                # (вид, id) -> (заголовок, текст, длина)
+        self._terms = []                    # отсортированный словарь для префиксного поиска
+        self._terms_dirty = False
+        self._built = False
+
+    def _add(self, key, title, body):
+        title_terms = tokenize(title)
+        terms = Counter(tokenize(body))
+        for term in title_terms:
+            # Совпадение в заголовке весит больше, как и в FTS-варианте
+            terms[term] += 10
+        for term, frequency in terms.items():
+            if term not in self._postings:
+                self._terms_dirty = True
+            self._postings[term][key] = frequency
+        self._documents[key] = (title, body, sum(terms.values()))
+
+    def _discard(self, key):
+        document = self._documents.pop(key, None)
+        if document is None:
+            return
+        for term in set(tokenize(document[0]) + tokenize(document[1])):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(key, None)
+                if not postings:
+                    del self._postings[term]
+                    self._terms_dirty = True
+
+    def _ensure_built(self):
+        if not self._built:
+            self.rebuild()
+
+    def index(self, kind, object_id, title, body):
+        with self._lock:
+            if self._built:
+                self._discard((kind, object_id))
+                self._add((kind, object_id), title, body)
+
+    def remove(self, kind, object_id):
+        with self._lock:
+            self._discard((kind, object_id))
+
+    def rebuild(self, chunk_size=2000):
+        with self._lock:
+            self._postings.clear()
+            self._documents.clear()
+            for kind in KINDS:
+                for object_id, title, body in iter_documents(kind, chunk_size):
+                    self._add((kind, object_id), title, body)
+            self._terms_dirty = True
+            self._built = True
+
+    def _expand(self, prefix):
+        if self._terms_dirty:
+            self._terms = sorted(self._postings)
+            self._terms_dirty = False
+        for position in range(bisect_left(self._terms, prefix), len(self._terms)):
+            term = self._terms[position]
+            if not term.startswith(prefix):
+                break
+            yield term
+
+    def _snippet(self, key, prefixes):
+        title, body, length = self._documents[key]
+        words = (body or title).split()
+        hits = [i for i, word in enumerate(words) if any(t.startswith(p) for t in tokenize(word) for p in prefixes)]
+        start = max(0, hits[0] - SNIPPET_WORDS // 2) if hits else 0
+        window = words[start:start + SNIPPET_WORDS]
+        marked = [f'{MARK_OPEN}{word}{MARK_CLOSE}' if start + i in hits else word for i, word in enumerate(window)]
+        text = ' '.join(marked)
+        if start > 0:
+            text = '…' + text
+        if start + SNIPPET_WORDS < len(words):
+            text += '…'
+        return render_snippet(text)
+
+    def search(self, terms, kind=None, limit=SEARCH_RESULTS_PER_PAGE, offset=0):
+        with self._lock:
+            self._ensure_built()
+            total = len(self._documents) or 1
+            scores = None
+            for prefix in terms:
+                term_scores = defaultdict(float)
+                for term in self._expand(prefix):
+                    postings = self._postings[term]
+                    idf = math.log(1 + total / len(postings))
+                    for key, frequency in postings.items():
+                        term_scores[key] += frequency * idf / (1 + self._documents[key][2])
+                if scores is None:
+                    scores = term_scores
+                else:
+                    # AND: остаются только документы, содержащие все термины
+                    scores = {key: score + term_scores[key] for key, score in scores.items() if key in term_scores}
+                if not scores:
+                    return []
+            ranked = sorted(((score, key) for key, score in scores.items() if not kind or key[0] == kind),
+                            key=lambda item: (-item[0], item[1]))
+            page = ranked[offset:offset + limit]
+            return [SearchHit(key[0], key[1], score, self._snippet(key, terms)) for score, key in page]
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = _create_backend()
+    return _backend
+
+
+def _create_backend():
+    choice = getattr(settings, 'SEARCH_BACKEND', 'auto')
+    if choice in ('auto', 'fts5') and connection.vendor == 'sqlite':
+        try:
+            return Fts5Backend()
+        except OperationalError:
+            if choice == 'fts5':
+                raise
+    return MemoryBackend()
+
+
+def index_instance(instance):
+    get_backend().index(KIND_BY_MODEL[type(instance)], instance.pk, *document_for(instance))
+
+
+def remove_instance(model, pk):
+    get_backend().remove(KIND_BY_MODEL[model], pk)
+
+
+def find_hits(query, kind=None, limit=SEARCH_RESULTS_PER_PAGE, offset=0):
+    terms = tokenize(query)
+    if not terms:
+        return []
+    return get_backend().search(terms, kind=kind, limit=limit, offset=offset)
+
+
+def attach_objects(hits):
+    # Объекты подтягиваются пачкой на каждый вид, а не по одному на результат
+    by_kind = defaultdict(list)
+    for hit in hits:
+        by_kind[hit.kind].append(hit.object_id)
+    objects = {}
+    for hit_kind, ids in by_kind.items():
+        model = KINDS[hit_kind][1]
+        queryset = model.objects.all()
+        if model is Comment:
+            queryset = queryset.select_related('post', 'author')
+        objects[hit_kind] = queryset.in_bulk(ids)
+    for hit in hits:
+        hit.object = objects[hit.kind].get(hit.object_id)
+    # Индекс мог отстать от удалённых записей
+    return [hit for hit in hits if hit.object is not None]
+
+
+def search_documents(query, kind=None, limit=SEARCH_RESULTS_PER_PAGE, offset=0):
+    return attach_objects(find_hits(query, kind=kind, limit=limit, offset=offset))
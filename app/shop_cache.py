@@ -0,0 +1,76 @@
+import hashlib
+import time
+from functools import wraps
+
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+# Кеш страниц магазина для анонимных посетителей. Все ключи содержат общую версию
+# каталога; любое изменение товара, категории или изображения меняет версию после
+# коммита (app/signals.py), и старые страницы просто перестают читаться.
+# Попадание в кеш обслуживается двумя обращениями к кешу, без запросов к БД.
+
+SHOP_CACHE_TIMEOUT = 60 * 15
+SHOP_VERSION_KEY = 'shop:version'
+
+
+def get_shop_version():
+    version = cache.get(SHOP_VERSION_KEY)
+    if version is None:
+        version = time.time_ns()
+        # add(), чтобы параллельный запрос не перетёр уже выставленную версию
+        if not cache.add(SHOP_VERSION_KEY, version, None):
+            version = cache.get(SHOP_VERSION_KEY, version)
+    return version
+
+
+def bump_shop_version():
+    cache.set(SHOP_VERSION_KEY, time.time_ns(), None)
+
+
+def _page_key(request, version):
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f'shop:page:{version}:{path}'
+
+
+def _cacheable_request(request):
+    if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+        return False
+    # Страница с флеш-сообщениями персональная
+    return not len(get_messages(request))
+
+
+def _finish(request, response, etag, last_modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    # Браузер каждый раз переспрашивает, но с If-None-Match получает пустой 304
+    patch_cache_control(response, public=True, max_age=0, must_revalidate=True)
+    patch_vary_headers(response, ('Cookie',))
+    return get_conditional_response(request, etag=etag, last_modified=last_modified, response=response)
+
+
+def cache_shop_page(view):
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not _cacheable_request(request):
+            return view(request, *args, **kwargs)
+
+        version = get_shop_version()
+        # Время последнего изменения каталога - та же версия
+        last_modified = version // 1_000_000_000
+        key = _page_key(request, version)
+        cached = cache.get(key)
+        if cached is not None:
+            content, content_type, etag = cached
+            return _finish(request, HttpResponse(content, content_type=content_type), etag, last_modified)
+
+        response = view(request, *args, **kwargs)
+        if response.status_code != 200 or response.streaming or response.cookies:
+            return response
+        etag = f'"{hashlib.md5(response.content).hexdigest()}"'
+        cache.set(key, (response.content, response['Content-Type'], etag), SHOP_CACHE_TIMEOUT)
+        return _finish(request, response, etag, last_modified)
+    return wrapper
@@ -0,0 +1,176 @@
+from django.apps import apps
+from django.db import transaction
+from django.db.models import F, QuerySet
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Post, Like, Comment, CommentLike, Favorite, Message, Category, Product, ProductImage, Follow
+from .messaging import record_message
+from .comments import bump_comments_version
+from . import search
+from .images import IMAGE_FIELDS, schedule_renditions, rendition_files
+from .media_cleanup import file_names, queue_file_deletion
+from .shop_cache import bump_shop_version
+from . import like_buffer, timeline, trending
+
+
+def _change_counter(model, pk, field, delta):
+    queryset = model.objects.filter(pk=pk)
+    if delta < 0:
+        # Не уходим в минус, если счётчик уже разъехался с таблицей
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    queryset.update(**{field: F(field) + delta})
+
+
+def _deleted_with(origin, *models):
+    # Если удаляется сам пост (или комментарий), обновлять его счётчики незачем
+    if isinstance(origin, QuerySet):
+        return origin.model in models
+    return isinstance(origin, models)
+
+
+# Счётчики лайков поста
+@receiver(post_save, sender=Like)
+def like_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        _change_counter(Post, instance.post_id, 'like_count', 1)
+        trending.record_activity(instance.post_id, 'like', moment=instance.created_at)
+
+@receiver(post_delete, sender=Like)
+def like_deleted(sender, instance, origin=None, **kwargs):
+    # Пачка из буфера лайков меняет счётчики сама (app/like_buffer.py)
+    if not _deleted_with(origin, Post) and not like_buffer.is_flushing():
+        _change_counter(Post, instance.post_id, 'like_count', -1)
+        trending.record_activity(instance.post_id, 'like', -1, moment=instance.created_at)
+
+# Счётчики комментариев поста
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        _change_counter(Post, instance.post_id, 'comment_count', 1)
+        trending.record_activity(instance.post_id, 'comment', moment=instance.create_at)
+    # Кеш отрендеренных комментариев сбрасывается после коммита, иначе его успеют
+    # заново заполнить без нового комментария
+    transaction.on_commit(lambda: bump_comments_version(instance.post_id))
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, origin=None, **kwargs):
+    if not _deleted_with(origin, Post):
+        _change_counter(Post, instance.post_id, 'comment_count', -1)
+        trending.record_activity(instance.post_id, 'comment', -1, moment=instance.create_at)
+        transaction.on_commit(lambda: bump_comments_version(instance.post_id))
+
+# Счётчики избранного
+@receiver(post_save, sender=Favorite)
+def favorite_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        _change_counter(Post, instance.post_id, 'favorite_count', 1)
+        trending.record_activity(instance.post_id, 'favorite', moment=instance.created_at)
+
+@receiver(post_delete, sender=Favorite)
+def favorite_deleted(sender, instance, origin=None, **kwargs):
+    if not _deleted_with(origin, Post):
+        _change_counter(Post, instance.post_id, 'favorite_count', -1)
+        trending.record_activity(instance.post_id, 'favorite', -1, moment=instance.created_at)
+
+# Лайки комментариев
+@receiver(post_save, sender=CommentLike)
+def comment_like_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        _change_counter(Comment, instance.comment_id, 'like_count', 1)
+
+@receiver(post_delete, sender=CommentLike)
+def comment_like_deleted(sender, instance, origin=None, **kwargs):
+    if not _deleted_with(origin, Post, Comment):
+        _change_counter(Comment, instance.comment_id, 'like_count', -1)
+
+# Сводка переписок
+@receiver(post_save, sender=Message)
+def message_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        record_message(instance)
+
+# Подписки и ленты: пост раскладывается по лентам подписчиков фоновой задачей,
+# которая ставится в той же транзакции, что и сам пост
+@receiver(post_save, sender=Post)
+def post_published(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        timeline.schedule_fanout(instance)
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        timeline.change_follower_count(instance.author_id, 1)
+        timeline.schedule_backfill(instance)
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    timeline.change_follower_count(instance.author_id, -1)
+    timeline.remove_author(instance.follower_id, instance.author_id)
+
+# Поисковый индекс обновляется после коммита
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=Comment)
+@receiver(post_save, sender=Product)
+def search_document_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        transaction.on_commit(lambda: search.index_instance(instance))
+
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=Comment)
+@receiver(post_delete, sender=Product)
+def search_document_deleted(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: search.remove_instance(sender, pk))
+
+# Кеш страниц магазина: новая версия каталога после коммита изменений
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=ProductImage)
+def shop_catalog_changed(sender, **kwargs):
+    transaction.on_commit(bump_shop_version)
+
+# Копии загруженных изображений строятся в фоне (задача ставится в той же транзакции)
+def _renditions_receiver(field):
+    def image_saved(sender, instance, raw=False, **kwargs):
+        if not raw:
+            schedule_renditions(instance, field)
+    return image_saved
+
+for _model_label, _field in IMAGE_FIELDS:
+    post_save.connect(_renditions_receiver(_field), sender=apps.get_model(_model_label),
+                      weak=False, dispatch_uid=f'renditions:{_model_label}.{_field}')
+
+# Старые файлы (и их копии) удаляются фоновой задачей после коммита. Прежнее имя файла
+# берётся из состояния, загруженного из БД (LoadedFilesMixin), без лишнего запроса
+def _file_replaced_receiver(field):
+    def file_saved(sender, instance, raw=False, using=None, **kwargs):
+        if raw:
+            return
+        # Созданная в этом процессе запись начинает отслеживаться с момента сохранения
+        loaded = instance.__dict__.setdefault('_loaded_files', {})
+        old_name = loaded.get(field)
+        new_name = getattr(instance, field).name
+        if old_name and old_name != new_name:
+            names = [old_name]
+            if instance.renditions.get('source') == old_name:
+                names += rendition_files(instance.renditions)
+            queue_file_deletion(names, using=using)
+        loaded[field] = new_name
+    return file_saved
+
+# post_delete приходит и при удалении через QuerySet, и при каскаде
+def _file_deleted_receiver(field):
+    def file_deleted(sender, instance, using=None, **kwargs):
+        queue_file_deletion(file_names(instance, field), using=using)
+    return file_deleted
+
+for _model_label, _field in IMAGE_FIELDS:
+    _model = apps.get_model(_model_label)
+    post_save.connect(_file_replaced_receiver(_field), sender=_model,
+                      weak=False, dispatch_uid=f'replaced-file:{_model_label}.{_field}')
+    post_delete.connect(_file_deleted_receiver(_field), sender=_model,
+                        weak=False, dispatch_uid=f'deleted-file:{_model_label}.{_field}')
@@ -1,4 +1,6 @@
 from django import template
+
+from ..images import rendition_url
 #Создание понтяного отступа доля комментариев на которые ответили
 register = template.Library()
 
@@ -7,4 +9,14 @@ def mul(value, args):
     try:
         return value * args
     except (TypeError, ValueError):
-        return ''
\ No newline at end of file
+        return ''
+
+# Ссылка на заранее построенную копию изображения: {{ profile.avatar|rendition:"card" }}
+# (какие копии есть у поля - images.FIELD_RENDITIONS). Пока копия не готова, отдаётся оригинал.
+@register.filter
+def rendition(value, args):
+    kind, _, fmt = args.partition('.')
+    try:
+        return rendition_url(value, kind, fmt or 'webp')
+    except ValueError:
+        return ''
@@ -0,0 +1,27 @@
+from django import template
+
+from ..thumbnails import parse_size, thumbnail_url, thumbnail_version
+
+# Миниатюры по требованию: {% thumbnail profile.avatar "60x60" crop=True %}
+# и набор для srcset: {% thumbnail_srcset profile.avatar "30x30" crop=True %} -> "url 1x, url 2x"
+register = template.Library()
+
+
+@register.simple_tag
+def thumbnail(file, size, fmt='webp', crop=False):
+    return thumbnail_url(file, parse_size(size), fmt, crop)
+
+
+@register.simple_tag
+def thumbnail_srcset(file, size, fmt='webp', crop=False, densities='1,2'):
+    width, height = parse_size(size)
+    if not file or thumbnail_version(file) is None:
+        # Пока миниатюр нет, src указывает на оригинал и плотности не нужны
+        return ''
+    candidates = []
+    for density in str(densities).split(','):
+        density = int(density)
+        url = thumbnail_url(file, (width * density, height * density), fmt, crop)
+        if url:
+            candidates.append(f"{url} {density}x")
+    return ', '.join(candidates)
@@ -1,3 +1,142 @@
-from django.test import TestCase
+import json
+import os
+import shutil
+import tempfile
+from collections import Counter
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import DatabaseError
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from . import like_buffer
+from .models import Post, Like, Comment, Favorite, Message
+from .profiling import assert_max_queries
+
+
+# Бюджеты запросов основных страниц. Каждая страница проверяется на малом и на большем
+# объёме данных: число запросов не должно расти с числом постов, комментариев и диалогов.
+# В бюджет входят чтение сессии и пользователя.
+class QueryBudgetTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reader', password='password')
+        self.client.force_login(self.user)
+
+    def create_data(self, count, prefix):
+        authors = [User.objects.create_user(f'{prefix}{index}', password='password') for index in range(count)]
+        for author in authors:
+            post = Post.objects.create(title='Пост', content='Текст', author=author)
+            Like.objects.create(user=self.user, post=post)
+            Favorite.objects.create(user=self.user, post=post)
+            for commenter in authors[:count // 2]:
+                Comment.objects.create(post=post, author=commenter, content='Комментарий')
+            Message.objects.create(sender=author, recipient=self.user, content='Привет')
+            Message.objects.create(sender=self.user, recipient=author, content='Ответ')
+        return authors[0], post
+
+    def assert_budget(self, url, limit):
+        # Без кеша: проверяется худший случай, а не повторный заход
+        cache.clear()
+        with assert_max_queries(limit):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_home(self):
+        for count in (3, 12):
+            self.create_data(count, f'home{count}-')
+            self.assert_budget(reverse('home'), 7)
+
+    def test_post_detail(self):
+        for count in (3, 12):
+            _, post = self.create_data(count, f'post{count}-')
+            self.assert_budget(reverse('post_detail', args=[post.id]), 10)
+
+    def test_messages_list(self):
+        for count in (3, 12):
+            contact, _ = self.create_data(count, f'messages{count}-')
+            self.assert_budget(reverse('messages_list'), 6)
+            self.assert_budget(reverse('messages_list', args=[contact.id]), 14)
+
+
+# Отложенная запись лайков (app/like_buffer.py). Интервал большой, чтобы фоновый поток
+# не вмешивался: пачки записываются явным вызовом flush()
+class LikeBufferTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.buffer = like_buffer.LikeBuffer(self.directory, interval=3600, max_size=1000)
+        patcher = mock.patch.multiple(like_buffer, _buffer=self.buffer, _buffer_pid=os.getpid())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.author = User.objects.create_user('author', password='password')
+        self.reader = User.objects.create_user('reader', password='password')
+        self.post = Post.objects.create(title='Пост', content='Текст', author=self.author)
+
+    def like_count(self):
+        return Post.objects.filter(pk=self.post.pk).values_list('like_count', flat=True).get()
+
+    def logs(self):
+        return sorted(os.listdir(self.directory))
+
+    @override_settings(LIKE_WRITE_BEHIND=True)
+    def test_read_your_writes(self):
+        self.assertEqual(like_buffer.set_like(self.reader, self.post, True), (True, 1))
+        self.assertFalse(Like.objects.exists())
+
+        post = Post.objects.get(pk=self.post.pk)
+        like_buffer.apply_overlay(self.reader, [post])
+        self.assertTrue(post.viewer_liked)
+        self.assertEqual(post.like_count, 1)
+
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertTrue(Like.objects.filter(user=self.reader, post=self.post).exists())
+        self.assertEqual(self.like_count(), 1)
+        self.assertEqual(self.buffer.overlay(self.reader.id, [self.post.id]), ({}, Counter()))
+        self.assertEqual(self.logs(), [])
+
+    def test_replay_orphan_log_with_truncated_line(self):
+        other = User.objects.create_user('other', password='password')
+        path = os.path.join(self.directory, 'likes-host-1-1.log')
+        with open(path, 'wb') as log:
+            log.write(json.dumps({'u': self.reader.id, 'p': self.post.id, 'a': True}).encode() + b'\n')
+            log.write(json.dumps({'u': other.id, 'p': self.post.id, 'a': True}).encode() + b'\n')
+            log.write(json.dumps({'u': other.id, 'p': self.post.id, 'a': False}).encode() + b'\n')
+            # Процесс упал посреди записи
+            log.write(b'{"u": %d, "p": %d, "a"' % (self.author.id, self.post.id))
+
+        self.assertEqual(like_buffer.replay_orphans(self.directory), 2)
+        self.assertEqual(list(Like.objects.values_list('user_id', flat=True)), [self.reader.id])
+        self.assertEqual(self.like_count(), 1)
+        self.assertEqual(self.logs(), [])
+
+    def test_apply_likes_is_idempotent(self):
+        states = {(self.reader.id, self.post.id): True}
+        like_buffer.apply_likes(states)
+        self.assertEqual(like_buffer.apply_likes(states), Counter())
+        self.assertEqual(Like.objects.count(), 1)
+        self.assertEqual(self.like_count(), 1)
+
+        states = {(self.reader.id, self.post.id): False}
+        like_buffer.apply_likes(states)
+        like_buffer.apply_likes(states)
+        self.assertFalse(Like.objects.exists())
+        self.assertEqual(self.like_count(), 0)
+
+    def test_failed_flush_returns_batch_to_pending(self):
+        self.buffer.record(self.reader.id, self.post.id, True)
+        with mock.patch.object(like_buffer, 'apply_likes', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                self.buffer.flush()
+        self.assertEqual(self.buffer._pending, {(self.reader.id, self.post.id): [False, True]})
+        self.assertEqual(self.buffer._inflight, {})
+        self.assertEqual(len(self.logs()), 1)
+
+        # Следующая запись проходит, журнал неудачной пачки удаляется
+        self.buffer.record(self.author.id, self.post.id, True)
+        self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(Like.objects.count(), 2)
+        self.assertEqual(self.like_count(), 2)
+        self.assertEqual(self.logs(), [])
@@ -0,0 +1,147 @@
+import hashlib
+import os
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.core import signing
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from PIL import Image, ImageOps
+
+from .images import render_image
+
+# Миниатюры произвольного размера по запросу шаблона: {% thumbnail image "60x60" %}.
+# Имя файла детерминировано: отпечаток содержимого, который фоновая задача копий
+# (app/images.py) записала в renditions модели, плюс размер и формат. Рендер шаблона
+# не обращается к файловой системе - ссылка всегда ведёт на view thumbnail, который
+# генерирует миниатюру при первом обращении, отмечает использование и перенаправляет
+# на файл в media. Каталог кеша ограничен по размеру (LRU по mtime).
+
+THUMBNAILS_DIR = 'thumbs'
+THUMBNAIL_CACHE_MAX_BYTES = getattr(settings, 'THUMBNAIL_CACHE_MAX_BYTES', 512 * 1024 * 1024)
+THUMBNAIL_TOUCH_INTERVAL = 60 * 60
+THUMBNAIL_PRUNE_EVERY = 100
+# Содержимое по ссылке не меняется (отпечаток в токене), браузер может её кешировать
+THUMBNAIL_MAX_AGE = 60 * 60 * 24 * 30
+SIZE_RE = re.compile(r'^(\d{1,4})x(\d{1,4})$')
+TOKEN_SALT = 'app.thumbnails'
+
+_generated = 0
+_prune_lock = threading.Lock()
+
+
+def parse_size(spec):
+    match = SIZE_RE.match(str(spec))
+    if not match:
+        raise ValueError(f"Некорректный размер миниатюры: {spec}")
+    width, height = int(match.group(1)), int(match.group(2))
+    if not width or not height:
+        raise ValueError(f"Некорректный размер миниатюры: {spec}")
+    return width, height
+
+
+def thumbnail_name(version, size, fmt, crop):
+    signature = f"{version}:{size[0]}x{size[1]}:{fmt}:{int(crop)}"
+    key = hashlib.sha1(signature.encode()).hexdigest()[:24]
+    return f"{THUMBNAILS_DIR}/{key[:2]}/{key}.{fmt}"
+
+
+def thumbnail_version(file):
+    renditions = getattr(file.instance, 'renditions', None) or {}
+    if renditions.get('source') != file.name:
+        return None
+    return renditions.get('version')
+
+
+def thumbnail_url(file, size, fmt='webp', crop=False):
+    if not file:
+        return ''
+    version = thumbnail_version(file)
+    if version is None:
+        # Задача копий ещё не отработала - как и фильтр rendition, показываем оригинал
+        return file.url
+    # Параметры подписаны, чтобы нельзя было заказать произвольный размер; подпись без
+    # метки времени, чтобы ссылка на одну и ту же миниатюру не менялась
+    token = signing.Signer(salt=TOKEN_SALT).sign_object(
+        {'n': file.name, 'v': version, 's': size, 'f': fmt, 'c': crop}, compress=True)
+    return reverse('thumbnail', args=[token])
+
+
+def load_token(token):
+    data = signing.Signer(salt=TOKEN_SALT).unsign_object(token)
+    return data['n'], data['v'], tuple(data['s']), data['f'], data['c']
+
+
+def touch_thumbnail(path):
+    # mtime служит отметкой последнего использования для LRU-очистки
+    if time.time() - os.stat(path).st_mtime > THUMBNAIL_TOUCH_INTERVAL:
+        os.utime(path)
+
+
+def generate_thumbnail(source_name, version, size, fmt, crop):
+    global _generated
+    name = thumbnail_name(version, size, fmt, crop)
+    path = default_storage.path(name)
+    try:
+        touch_thumbnail(path)
+        return name
+    except FileNotFoundError:
+        pass
+
+    with default_storage.open(source_name) as source:
+        image = ImageOps.exif_transpose(Image.open(source))
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        if crop:
+            image = ImageOps.fit(image, size)
+        content = render_image(image, size, fmt)
+
+    # Запись через временный файл: параллельный запрос не увидит недописанную миниатюру
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, 'wb') as output:
+        output.write(content)
+    os.replace(temp_path, path)
+
+    _generated += 1
+    if _generated % THUMBNAIL_PRUNE_EVERY == 0:
+        threading.Thread(target=prune_thumbnails, daemon=True).start()
+    return name
+
+
+def prune_thumbnails(max_bytes=THUMBNAIL_CACHE_MAX_BYTES):
+    if not _prune_lock.acquire(blocking=False):
+        return 0
+    try:
+        root = default_storage.path(THUMBNAILS_DIR)
+        entries = []
+        total = 0
+        for directory, _, files in os.walk(root):
+            for filename in files:
+                path = os.path.join(directory, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        if total <= max_bytes:
+            return 0
+
+        # Удаляем давно не использованные, пока не опустимся до 90% лимита
+        removed = 0
+        entries.sort()
+        for _, size, path in entries:
+            if total <= max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        return removed
+    finally:
+        _prune_lock.release()
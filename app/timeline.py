@@ -0,0 +1,191 @@
+import math
+from datetime import timedelta
+
+from django.db.models import F
+from django.utils import timezone
+
+from . import jobs
+from .feed import FEED_PAGE_SIZE, feed_queryset
+from .models import Follow, Post, TimelineEntry, TrendingBucket, UserProfile
+from .pagination import KeysetPage, decode_cursor, encode_cursor, keyset_filter
+from .trending import bucket_start
+
+# Персональная лента: посты авторов, на которых подписан пользователь.
+# При публикации пост раскладывается фоновой задачей по лентам подписчиков (fan-out),
+# поэтому страница ленты - один диапазон индекса (user, score, post) в TimelineEntry,
+# сколько бы авторов пользователь ни читал. Посты авторов с очень большим числом
+# подписчиков не раскладываются, а подмешиваются при чтении (pull) - их единицы.
+# Когда автор опускается ниже порога, его последние посты раскладываются по лентам
+# всех подписчиков (author_backfill): иначе пропали бы посты и подписки периода pull.
+# При переходе вверх ничего делать не нужно - pull читает посты автора целиком.
+#
+# Лента упорядочена по "горячести" (hot_score: лайки, комментарии, избранное и возраст),
+# которая хранится в TimelineEntry.score. При раскладке пишется текущая оценка поста,
+# а команда rescore_timeline (по расписанию, вместе с compact_trending) пересчитывает
+# её у постов с недавней активностью - их находит TrendingBucket.
+
+TIMELINE_ORDERING = ('-score', '-post_id')
+FANOUT_CHUNK_SIZE = 1000
+FANOUT_MAX_FOLLOWERS = 10000
+FOLLOW_BACKFILL = 50
+# Пост на HOT_SCORE_PERIOD секунд новее весит как в 10 раз более обсуждаемый
+HOT_SCORE_PERIOD = 45000
+# С запасом больше периода запуска rescore_timeline
+TIMELINE_RESCORE_WINDOW = timedelta(hours=2)
+TIMELINE_RESCORE_CHUNK_SIZE = 500
+SCORE_FIELDS = ('id', 'created_at', 'like_count', 'comment_count', 'favorite_count')
+
+
+def hot_score(post):
+    engagement = post.like_count + 2 * post.comment_count + post.favorite_count
+    return math.log10(max(engagement, 1)) + post.created_at.timestamp() / HOT_SCORE_PERIOD
+
+
+def change_follower_count(author_id, delta):
+    if delta > 0:
+        UserProfile.objects.get_or_create(user_id=author_id)
+    queryset = UserProfile.objects.filter(user_id=author_id)
+    if delta < 0:
+        queryset = queryset.filter(follower_count__gte=-delta)
+    if not queryset.update(follower_count=F('follower_count') + delta) or delta > 0:
+        return
+    # Автор опустился ниже порога - выходит из pull
+    count = UserProfile.objects.filter(user_id=author_id).values_list('follower_count', flat=True).get()
+    if count < FANOUT_MAX_FOLLOWERS <= count - delta:
+        jobs.enqueue('timeline.author_backfill', author_id=author_id)
+
+
+def is_pull_author(author_id):
+    count = UserProfile.objects.filter(user_id=author_id).values_list('follower_count', flat=True).first()
+    return (count or 0) >= FANOUT_MAX_FOLLOWERS
+
+
+def pull_authors(user):
+    # От индекса по follower_count к подпискам пользователя: популярных авторов
+    # единицы, а подписок у пользователя может быть сколько угодно
+    popular = UserProfile.objects.filter(follower_count__gte=FANOUT_MAX_FOLLOWERS).values('user_id')
+    return list(Follow.objects.filter(follower=user, author_id__in=popular).values_list('author_id', flat=True))
+
+
+def _scores(posts):
+    return {post.id: hot_score(post) for post in posts}
+
+
+def _add_entries(scores, author_id, user_ids):
+    # scores: {post_id: hot_score}; ignore_conflicts: повтор задачи после сбоя не создаёт дублей
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(user_id=user_id, post_id=post_id, author_id=author_id, score=score)
+         for user_id in user_ids for post_id, score in scores.items()],
+        batch_size=FANOUT_CHUNK_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def _follower_chunks(author_id, chunk_size):
+    # Подписчики пачками по id
+    followers = Follow.objects.filter(author_id=author_id).order_by('id').values_list('id', 'follower_id')
+    last_id = 0
+    while True:
+        chunk = list(followers.filter(id__gt=last_id)[:chunk_size])
+        if not chunk:
+            return
+        yield [follower_id for _, follower_id in chunk]
+        last_id = chunk[-1][0]
+
+
+def _recent_posts(author_id):
+    posts = Post.objects.filter(author_id=author_id).only(*SCORE_FIELDS).order_by('-id')
+    return _scores(posts[:FOLLOW_BACKFILL])
+
+
+def schedule_fanout(post):
+    return jobs.enqueue('timeline.fanout', post_id=post.pk)
+
+
+def schedule_backfill(follow):
+    return jobs.enqueue('timeline.backfill', follower_id=follow.follower_id, author_id=follow.author_id)
+
+
+@jobs.handler('timeline.fanout')
+def fan_out(post_id, chunk_size=FANOUT_CHUNK_SIZE):
+    post = Post.objects.filter(pk=post_id).only('author_id', *SCORE_FIELDS).first()
+    if post is None:
+        return
+    author_id = post.author_id
+    scores = _scores([post])
+    # Свои посты автор видит в своей ленте всегда
+    _add_entries(scores, author_id, [author_id])
+    if is_pull_author(author_id):
+        return
+
+    # Каждая пачка подписчиков - одна вставка в своей транзакции
+    for follower_ids in _follower_chunks(author_id, chunk_size):
+        _add_entries(scores, author_id, follower_ids)
+
+
+@jobs.handler('timeline.backfill')
+def backfill(follower_id, author_id):
+    # Новая подписка: последние посты автора сразу появляются в ленте
+    if is_pull_author(author_id) or not Follow.objects.filter(follower_id=follower_id, author_id=author_id).exists():
+        return
+    _add_entries(_recent_posts(author_id), author_id, [follower_id])
+
+
+@jobs.handler('timeline.author_backfill')
+def author_backfill(author_id, chunk_size=FANOUT_CHUNK_SIZE):
+    # Автор вышел из pull: посты и подписки этого периода в ленты не раскладывались
+    if is_pull_author(author_id):
+        return
+    scores = _recent_posts(author_id)
+    if not scores:
+        return
+    for follower_ids in _follower_chunks(author_id, max(chunk_size // len(scores), 1)):
+        _add_entries(scores, author_id, follower_ids)
+
+
+def remove_author(follower_id, author_id):
+    TimelineEntry.objects.filter(user_id=follower_id, author_id=author_id).delete()
+
+
+def rescore_timeline(since=None, chunk_size=TIMELINE_RESCORE_CHUNK_SIZE):
+    # since=None - все посты, разложенные по лентам (после добавления поля score)
+    if since is None:
+        post_ids = TimelineEntry.objects.order_by('post_id').values_list('post_id', flat=True).distinct()
+    else:
+        post_ids = (TrendingBucket.objects.filter(bucket__gte=bucket_start(since))
+                    .order_by('post_id').values_list('post_id', flat=True).distinct())
+    post_ids = list(post_ids)
+    updated = 0
+    for start in range(0, len(post_ids), chunk_size):
+        posts = Post.objects.filter(pk__in=post_ids[start:start + chunk_size]).only(*SCORE_FIELDS)
+        for post_id, score in _scores(posts).items():
+            # Одно UPDATE на пост по индексу post; строки с той же оценкой не переписываются
+            updated += TimelineEntry.objects.filter(post_id=post_id).exclude(score=score).update(score=score)
+    return updated
+
+
+def rescore_recent(now=None):
+    return rescore_timeline(since=(now or timezone.now()) - TIMELINE_RESCORE_WINDOW)
+
+
+def get_timeline_page(user, cursor=None, page_size=FEED_PAGE_SIZE):
+    after = decode_cursor(TimelineEntry, TIMELINE_ORDERING, cursor) if cursor else None
+
+    entries = TimelineEntry.objects.filter(user=user)
+    if after is not None:
+        entries = entries.filter(keyset_filter(TIMELINE_ORDERING, after))
+    keys = list(entries.order_by(*TIMELINE_ORDERING).values_list('score', 'post_id')[:page_size + 1])
+    # Посты популярных авторов не разложены: последние FOLLOW_BACKFILL постов каждого
+    # оцениваются при чтении; более старые в ленте не показываются
+    for author_id in pull_authors(user):
+        for post_id, score in _recent_posts(author_id).items():
+            if after is None or (score, post_id) < tuple(after):
+                keys.append((score, post_id))
+
+    keys = sorted(set(keys), reverse=True)
+    next_cursor = None
+    if len(keys) > page_size:
+        keys = keys[:page_size]
+        next_cursor = encode_cursor(list(keys[-1]))
+    posts = feed_queryset().in_bulk([post_id for _, post_id in keys])
+    return KeysetPage([posts[post_id] for _, post_id in keys if post_id in posts], next_cursor)
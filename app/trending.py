@@ -0,0 +1,109 @@
+import logging
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, FloatField, Sum, Value, When
+from django.utils import timezone
+
+from .feed import feed_queryset
+from .models import TrendingBucket
+
+logger = logging.getLogger(__name__)
+
+# Популярное: посты с наибольшей недавней активностью. Каждое действие прибавляет
+# очки к строке (пост, час) в TrendingBucket - одно UPDATE, без подсчёта по Like/Comment.
+# Рейтинг - сумма очков по часам окна с затуханием: час давностью TRENDING_HALF_LIFE
+# весит вдвое меньше текущего. Готовый топ лежит в кеше; его пересчитывает команда
+# compact_trending (по расписанию), заодно удаляя часы, вышедшие из окна.
+
+TRENDING_WEIGHTS = {'like': 1, 'comment': 3, 'favorite': 2}
+TRENDING_BUCKET = timedelta(hours=1)
+TRENDING_WINDOW = timedelta(hours=48)
+TRENDING_HALF_LIFE = timedelta(hours=6)
+TRENDING_SIZE = 50
+TRENDING_CACHE_KEY = 'trending:top'
+# С запасом больше периода запуска compact_trending
+TRENDING_CACHE_TIMEOUT = 60 * 15
+
+
+def bucket_start(moment=None):
+    moment = moment or timezone.now()
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def record_activity(post_id, kind, delta=1, moment=None):
+    # moment - когда действие было совершено: снятый лайк вычитается из того часа,
+    # в который был поставлен, а действия старше окна на рейтинг уже не влияют
+    points = TRENDING_WEIGHTS[kind] * delta
+    bucket = bucket_start(moment)
+    if bucket < bucket_start() - TRENDING_WINDOW:
+        return
+    if TrendingBucket.objects.filter(post_id=post_id, bucket=bucket).update(points=F('points') + points):
+        return
+    try:
+        # Первое действие с постом за этот час; точка сохранения, чтобы гонка
+        # с параллельной вставкой не ломала внешнюю транзакцию
+        with transaction.atomic():
+            TrendingBucket.objects.create(post_id=post_id, bucket=bucket, points=points)
+    except IntegrityError:
+        TrendingBucket.objects.filter(post_id=post_id, bucket=bucket).update(points=F('points') + points)
+
+
+def decay(bucket, now):
+    return 0.5 ** ((now - bucket) / TRENDING_HALF_LIFE)
+
+
+def trending_queryset(now=None):
+    now = bucket_start(now)
+    # Коэффициент затухания одинаков для всех строк одного часа - CASE по часам окна,
+    # сумма и сортировка выполняются в БД
+    hours = int(TRENDING_WINDOW / TRENDING_BUCKET)
+    weight = Case(
+        *[When(bucket=now - TRENDING_BUCKET * index, then=Value(decay(now - TRENDING_BUCKET * index, now)))
+          for index in range(hours + 1)],
+        default=Value(0.0),
+        output_field=FloatField(),
+    )
+    return (TrendingBucket.objects
+            .filter(bucket__gte=now - TRENDING_WINDOW)
+            .values('post_id')
+            .annotate(score=Sum(F('points') * weight, output_field=FloatField()))
+            .filter(score__gt=0)
+            .order_by('-score', '-post_id')
+            .values_list('post_id', 'score'))
+
+
+def compute_trending(size=TRENDING_SIZE, now=None):
+    return [(post_id, round(score, 3)) for post_id, score in trending_queryset(now)[:size]]
+
+
+def refresh_trending(now=None):
+    top = compute_trending(now=now)
+    cache.set(TRENDING_CACHE_KEY, top, TRENDING_CACHE_TIMEOUT)
+    return top
+
+
+def get_trending():
+    top = cache.get(TRENDING_CACHE_KEY)
+    if top is None:
+        top = refresh_trending()
+    return top
+
+
+def trending_posts():
+    top = get_trending()
+    posts = feed_queryset().in_bulk([post_id for post_id, _ in top])
+    # Удалённые после пересчёта посты просто пропускаются
+    return [posts[post_id] for post_id, _ in top if post_id in posts]
+
+
+def compact_trending(now=None):
+    now = now or timezone.now()
+    expired = TrendingBucket.objects.filter(bucket__lt=bucket_start(now) - TRENDING_WINDOW)
+    deleted, _ = expired.delete()
+    # Часы, где действия взаимно погасились (лайк и снятие лайка)
+    empty, _ = TrendingBucket.objects.filter(points=0, bucket__lt=bucket_start(now)).delete()
+    top = refresh_trending(now)
+    logger.info("Популярное: удалено часов %s, пустых %s, в топе %s", deleted, empty, len(top))
+    return deleted + empty, top
@@ -3,6 +3,10 @@ from . import views
 
 urlpatterns = [
     path('', views.home, name='home'),
+    path('posts/more', views.home_more, name='home_more'),
+    path('feed/', views.timeline, name='timeline'),
+    path('feed/more', views.timeline_more, name='timeline_more'),
+    path('trending/', views.trending, name='trending'),
 
     path('my_posts/', views.my_posts, name='my_posts'),
 
@@ -18,6 +22,12 @@ urlpatterns = [
     path('post/<int:post_id>/like', views.toggle_like, name='toggle_like'),
 
     path('post/<int:post_id>/comment', views.add_comment, name='add_comment'),
+    path('post/<int:post_id>/comments', views.comment_threads, name='comment_threads'),
+    path('post/<int:post_id>/comments/<int:comment_id>/replies', views.comment_replies, name='comment_replies'),
+
+    path('search/', views.search, name='search'),
+    path('thumbnail/<str:token>', views.thumbnail, name='thumbnail'),
+    path('profiling/stats', views.profiling_summary, name='profiling_stats'),
 
     path('favorites/', views.favorites, name='favorites'),
     path('post/<int:post_id>/toggle_favorite/', views.toggle_favorite, name='toggle_favorite'),
@@ -25,14 +35,22 @@ urlpatterns = [
     path('messages/', views.messages_list, name='messages_list'),
     path('messages/<int:recipient_id>', views.messages_list, name='messages_list'),
     path('messages/send/<int:recipient_id>', views.send_message, name='send_message'),
+    path('messages/<int:recipient_id>/read', views.mark_messages_read, name='mark_messages_read'),
+    path('messages/<int:recipient_id>/receipts', views.read_receipts, name='read_receipts'),
+    path('messages/read-all', views.mark_all_messages_read, name='mark_all_messages_read'),
+    path('messages/<int:recipient_id>/history', views.conversation_messages, name='conversation_messages'),
+    path('messages/stream', views.message_stream, name='message_stream'),
 
     path('profile', views.profile_edit, name='profile_edit'),
     path('profile/<str:username>/', views.profile_view, name='profile_view'),
+    path('profile/<str:username>/follow', views.toggle_follow, name='toggle_follow'),
 
     path('shop/', views.shop_home, name="shop_home"),
     path('shop/category/<int:category_id>/', views.shop_category, name="shop_category"),
+    path('shop/api/products', views.shop_catalog_api, name="shop_catalog_api"),
     path('shop/product/<int:product_id>/', views.shop_product_detail, name="shop_product_detail"),
 
     path('shop/product/<int:product_id>/checkout/', views.shop_checkout, name="shop_checkout"),
     path('shop/success', views.shop_success, name="shop_success"),
+    path('shop/yookassa/webhook', views.yookassa_webhook, name="yookassa_webhook"),
 ]
\ No newline at end of file
@@ -0,0 +1,41 @@
+from . import like_buffer
+from .models import Like, Favorite, CommentLike
+
+# Состояние читателя для страницы постов: лайкнул ли он пост, добавил ли в избранное.
+# Флаги всей страницы загружаются одним запросом на таблицу (по уникальному индексу
+# (user, post)) и записываются в объекты как viewer_liked/viewer_favorited,
+# вместо exists() на каждую карточку.
+
+
+def _marked(model, user, field, ids):
+    if not ids or not user.is_authenticated:
+        return set()
+    return set(model.objects.filter(user=user, **{f'{field}__in': ids}).values_list(field, flat=True))
+
+
+def load_viewer_state(user, posts):
+    posts = list(posts)
+    ids = [post.id for post in posts]
+    liked = _marked(Like, user, 'post_id', ids)
+    favorited = _marked(Favorite, user, 'post_id', ids)
+    for post in posts:
+        post.viewer_id = user.id
+        post.viewer_liked = post.id in liked
+        post.viewer_favorited = post.id in favorited
+    if user.is_authenticated:
+        like_buffer.apply_overlay(user, posts)
+    return posts
+
+
+def liked_comment_ids(user, comment_ids):
+    # HTML комментариев общий для всех читателей (кеш в app/comments.py),
+    # поэтому отметки передаются отдельно списком id
+    return sorted(_marked(CommentLike, user, 'comment_id', comment_ids))
+
+
+def load_comment_state(user, comments):
+    comments = list(comments)
+    liked = set(liked_comment_ids(user, [comment.id for comment in comments]))
+    for comment in comments:
+        comment.viewer_liked = comment.id in liked
+    return comments
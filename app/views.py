@@ -1,18 +1,38 @@
-from django.shortcuts import render, redirect, get_object_or_404
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
 from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponseRedirect
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import HttpResponse, HttpResponseRedirect, HttpResponseBadRequest, JsonResponse, Http404
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from django.utils.cache import patch_cache_control
+from django.template.loader import render_to_string
 from django.urls import reverse
 from django.contrib.auth.models import User
-from django.db.models import Q
-from .forms import UserRegisterForm, UserLoginForm, PostForm, CommentForm, UserProfileForm, MessageForm
-from .models import Post, Like, Comment, UserProfile, Favorite, Message, Category, Product, Order
-import yookassa
-from django.conf import settings
-
-yookassa.Configuration.account_id = settings.YOOKASSA_SHOP_ID
-yookassa.Configuration.secret_key = settings.YOOKASSA_SECRET_KEY
+from django.db import transaction
+import json
+from django.core.paginator import Paginator
+from django.core import signing
+from django.core.files.storage import default_storage
+from .forms import UserRegisterForm, UserLoginForm, PostForm, CommentForm, UserProfileForm, MessageForm, CatalogFilterForm
+from .models import Post, Comment, UserProfile, Follow, Conversation, Category, Product, Order
+from .feed import feed_queryset, get_feed_page
+from .timeline import get_timeline_page
+from .trending import trending_posts
+from .viewer_state import load_viewer_state, liked_comment_ids
+from .reactions import parse_state, set_reaction
+from .pagination import InvalidCursor
+from .comments import InvalidPathCursor, render_thread_page, render_subtree_page
+from .search import KINDS as SEARCH_KINDS, SEARCH_RESULTS_PER_PAGE, attach_objects, find_hits
+from .messaging import (CONVERSATIONS_PER_PAGE, inbox_queryset, mark_conversation_read, mark_all_read, read_receipt,
+                        get_unread_count, conversation_page, messages_since, message_json)
+from .thumbnails import THUMBNAIL_MAX_AGE, load_token, generate_thumbnail
+from .profiling import stats as profiling_stats
+from .shop_cache import cache_shop_page, get_shop_version
+from .catalog import get_catalog_page, primary_image_prefetch
+from .thumbnails import thumbnail_url
+from .payments import PaymentError, create_payment, get_payment, apply_payment, is_payment_id
 
 # Create your views here.
 def register(request):
@@ -52,38 +72,115 @@ def user_logout(request):
 
 @login_required # Проверка на вход в аккунт, будет ли показывать информацию не залогиненым
 def home(request):
-    # Получаем все объекты Post из базы данных
-    posts = Post.objects.all()
+    # Получаем одну страницу постов по курсору (created_at, id), а не всю таблицу
+    try:
+        page = get_feed_page(cursor=request.GET.get('cursor'))
+    except InvalidCursor:
+        return HttpResponseBadRequest("Некорректный курсор")
 
     # Передаем список posts в шаблон home.html через контекст
     context = {
-        'posts': posts, # 'posts' - это имя переменной, которое будет доступно в шаблоне
+        'posts': load_viewer_state(request.user, page.items), # 'posts' - это имя переменной, которое будет доступно в шаблоне
+        'next_cursor': page.next_cursor,
+    }
+    return render(request, 'app/home.html', context)
+
+# Подгрузка следующей страницы ленты ("Загрузить ещё")
+@login_required
+def home_more(request):
+    try:
+        page = get_feed_page(cursor=request.GET.get('cursor'))
+    except InvalidCursor:
+        return HttpResponseBadRequest("Некорректный курсор")
+
+    posts = load_viewer_state(request.user, page.items)
+    html = render_to_string('app/post_cards.html', {'posts': posts}, request=request)
+    return JsonResponse({'html': html, 'next_cursor': page.next_cursor})
+
+# Лента подписок: посты из заранее разложенной ленты пользователя
+@login_required
+def timeline(request):
+    try:
+        page = get_timeline_page(request.user, cursor=request.GET.get('cursor'))
+    except InvalidCursor:
+        return HttpResponseBadRequest("Некорректный курсор")
+
+    context = {
+        'posts': load_viewer_state(request.user, page.items),
+        'next_cursor': page.next_cursor,
+        'more_url': reverse('timeline_more'),
+        'feed_title': "Моя лента:",
+        'empty_message': "Здесь появятся посты авторов, на которых вы подписаны.",
+    }
+    return render(request, 'app/home.html', context)
+
+@login_required
+def timeline_more(request):
+    try:
+        page = get_timeline_page(request.user, cursor=request.GET.get('cursor'))
+    except InvalidCursor:
+        return HttpResponseBadRequest("Некорректный курсор")
+
+    posts = load_viewer_state(request.user, page.items)
+    html = render_to_string('app/post_cards.html', {'posts': posts}, request=request)
+    return JsonResponse({'html': html, 'next_cursor': page.next_cursor})
+
+# Популярное: готовый топ из кеша (app/trending.py)
+@login_required
+def trending(request):
+    context = {
+        'posts': load_viewer_state(request.user, trending_posts()),
+        'feed_title': "Популярное:",
+        'empty_message': "За последние двое суток активности не было.",
     }
     return render(request, 'app/home.html', context)
 
 @login_required
 def post_detail(request, post_id):
     # Получаем конкретный пост по ID или возвращаем 404, если не найден
-    post = get_object_or_404(Post, id=post_id)
-
-    user_liked = False
-    user = request.user
-    if user.is_authenticated:
-        user_liked = post.likes.filter(user=user).exists()
+    post = get_object_or_404(feed_queryset(), id=post_id)
 
-    user_favorited = post.favorited_by.filter(user=request.user).exists()
+    # Лайк и избранное читателя - тем же загрузчиком, что и для карточек ленты
+    load_viewer_state(request.user, [post])
 
-    all_comments = Comment.objects.filter(post=post).select_related("author").prefetch_related("comment_likes").order_by("create_at")
-    comment_tree = build_comment_tree(all_comments)
+    # Первая страница веток (корни + первые ответы) - готовый HTML из кеша поста
+    comments_html, comments_cursor, comment_ids = render_thread_page(post)
 
     comment_form = CommentForm(post_id=post_id)
     # Можно передать дополнительные данные, например, комментарии
     return render(request, 'app/post_detail.html',
                   {'post': post,
-                   'user_liked': user_liked,
+                   'user_liked': post.viewer_liked,
                    'comment_form': comment_form,
-                   'comment_tree': comment_tree,
-                   'user_favorited': user_favorited,})
+                   'comments_html': comments_html,
+                   'comments_cursor': comments_cursor,
+                   'liked_comments': liked_comment_ids(request.user, comment_ids),
+                   'user_favorited': post.viewer_favorited,})
+
+# Следующая страница веток комментариев
+@login_required
+def comment_threads(request, post_id):
+    post = get_object_or_404(Post, id=post_id)
+    try:
+        html, next_cursor, comment_ids = render_thread_page(post, after=request.GET.get('after'))
+    except InvalidPathCursor:
+        return HttpResponseBadRequest("Некорректный курсор")
+
+    return JsonResponse({'html': html, 'next_cursor': next_cursor,
+                         'liked': liked_comment_ids(request.user, comment_ids)})
+
+# Продолжение ветки: ответы внутри поддерева комментария
+@login_required
+def comment_replies(request, post_id, comment_id):
+    post = get_object_or_404(Post, id=post_id)
+    comment = get_object_or_404(Comment, id=comment_id, post=post)
+    try:
+        html, next_cursor, comment_ids = render_subtree_page(post, comment, after=request.GET.get('after'))
+    except InvalidPathCursor:
+        return HttpResponseBadRequest("Некорректный курсор")
+
+    return JsonResponse({'html': html, 'next_cursor': next_cursor,
+                         'liked': liked_comment_ids(request.user, comment_ids)})
 
 @login_required
 def post_create(request):
@@ -113,20 +210,24 @@ def del_post(request, post_id):
     messages.warning(request, "Хорошая попытка, но для удаления воспользуйтесь кнопкой - удаление поста")
     return redirect('post_detail', post_id=post_id)
 
-@login_required
-def toggle_like(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
-    like_object, created = Like.objects.get_or_create(user=request.user, post=post)
+def _wants_json(request):
+    return request.headers.get('X-Requested-With') == 'XMLHttpRequest'
 
-    if created:
-        action = "Liked"
-    else:
-        like_object.delete()
-        action = "Unliked"
-    messages.info(request,f"{action} пост {post.title}.")
+# Ответ на лайк/избранное: скрипту страницы - JSON с новым состоянием и счётчиком,
+# без скрипта - редирект обратно с сообщением
+def _reaction_response(request, post, kind, message):
+    active, count = set_reaction(request.user, post, kind, parse_state(request.POST.get('state')))
+    if _wants_json(request):
+        return JsonResponse({'kind': kind, 'active': active, 'count': count})
+    messages.info(request, message(active))
+    return HttpResponseRedirect(request.META.get('HTTP_REFERER', reverse('home')))
 
-    next_url = request.META.get("HTTP_REFERER", reverse("home"))
-    return HttpResponseRedirect(next_url)
+@login_required
+@require_POST
+def toggle_like(request, post_id):
+    post = get_object_or_404(Post.objects.only('id', 'title', 'author_id'), id=post_id)
+    return _reaction_response(request, post, 'like',
+                              lambda active: f"{'Liked' if active else 'Unliked'} пост {post.title}.")
 
 @login_required
 def post_edit(request, post_id):
@@ -158,35 +259,83 @@ def add_comment(request, post_id):
             comment = form.save(commit=False)
             comment.post = post
             comment.author = request.user
-            comment.save()
+            with transaction.atomic():
+                comment.save()
             messages.success(request, f"Сообщение к посту {post.title} было успешно добавлено")
             return redirect('post_detail', post_id=post.id)
 
     return redirect('post_detail', post_id=post.id)
 
-# Построение комментариев в виде дерева
-def build_comment_tree(comments):
-    comment_dict = {}
-    root_comments = []
-
-    for comment in comments:
-        comment_dict[comment.id] = {'comment': comment, 'replies': []}
+# Поиск по постам, комментариям и товарам
+@login_required
+def search(request):
+    query = request.GET.get('q', '').strip()
+    kind = request.GET.get('type')
+    if kind not in SEARCH_KINDS:
+        kind = None
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+
+    # На одну запись больше, чтобы понять, есть ли следующая страница. Считаем по ответу
+    # индекса до отсева устаревших записей: иначе удалённый объект на странице прятал бы
+    # ссылку на следующую, хотя смещения страниц считаются по индексу
+    hits = find_hits(query, kind=kind, limit=SEARCH_RESULTS_PER_PAGE + 1,
+                     offset=(page - 1) * SEARCH_RESULTS_PER_PAGE)
 
-    for item in comment_dict.values():
-        comment_obj = item['comment']
-        if comment_obj.parent_id:
-            parent_item = comment_dict.get(comment_obj.parent_id)
-            if parent_item:
-                parent_item['replies'].append(item)
-        else:
-            root_comments.append(item)
-    return root_comments
+    context = {
+        'query': query,
+        'kind': kind,
+        'hits': attach_objects(hits[:SEARCH_RESULTS_PER_PAGE]),
+        'page': page,
+        'has_next': len(hits) > SEARCH_RESULTS_PER_PAGE,
+    }
+    return render(request, 'app/search.html', context)
+
+# Генерация миниатюры при первом обращении и перенаправление на файл в media
+def thumbnail(request, token):
+    try:
+        source_name, version, size, fmt, crop = load_token(token)
+        name = generate_thumbnail(source_name, version, size, fmt, crop)
+    except (signing.BadSignature, OSError):
+        # OSError - нет исходника, а также повреждённый файл или не изображение
+        # (UnidentifiedImageError из PIL - его подкласс)
+        raise Http404
+    response = redirect(default_storage.url(name))
+    patch_cache_control(response, public=True, max_age=THUMBNAIL_MAX_AGE)
+    return response
+
+# Скользящая статистика времени ответа по представлениям (p50/p95)
+@staff_member_required
+def profiling_summary(request):
+    if request.method == 'POST' and request.POST.get('reset'):
+        profiling_stats.clear()
+    return JsonResponse(profiling_stats.summary())
 
 @login_required
 def profile_view(request, username):
     user = get_object_or_404(User, username=username)
     profile, created = UserProfile.objects.get_or_create(user=user)
-    return render(request, 'app/profile_view.html', {'profile_user': user, 'profile': profile})
+    is_following = Follow.objects.filter(follower=request.user, author=user).exists()
+    return render(request, 'app/profile_view.html',
+                  {'profile_user': user, 'profile': profile, 'is_following': is_following})
+
+@login_required
+@require_POST
+def toggle_follow(request, username):
+    author = get_object_or_404(User, username=username)
+    if author == request.user:
+        messages.error(request, "Нельзя подписаться на себя")
+        return redirect('profile_view', username=username)
+
+    deleted, _ = Follow.objects.filter(follower=request.user, author=author).delete()
+    if deleted:
+        messages.success(request, f"Вы отписались от {author.username}")
+    else:
+        Follow.objects.get_or_create(follower=request.user, author=author)
+        messages.success(request, f"Вы подписались на {author.username}")
+    return redirect('profile_view', username=username)
 
 @login_required
 def profile_edit(request):
@@ -206,13 +355,13 @@ def profile_edit(request):
 
 @login_required
 def my_posts(request):
-    posts = Post.objects.filter(author=request.user).select_related('author__profile').prefetch_related('likes', 'comments')
+    posts = load_viewer_state(request.user, feed_queryset().filter(author=request.user))
     return render(request, 'app/my_posts.html', {'posts': posts})
 
 @login_required
 def favorites(request):
-    favorite_entries = Favorite.objects.filter(user=request.user).select_related('post__author__profile').prefetch_related('post__likes', 'post__comments')
-    posts = [entry.post for entry in favorite_entries]
+    posts = feed_queryset().filter(favorited_by__user=request.user).order_by('-favorited_by__created_at')
+    posts = load_viewer_state(request.user, posts)
 
     context = {
         'posts': posts,
@@ -221,70 +370,95 @@ def favorites(request):
     return render(request, 'app/favorites.html', {'posts': posts})
 
 @login_required
+@require_POST
 def toggle_favorite(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
-    if post.author == request.user:
+    post = get_object_or_404(Post.objects.only('id', 'title', 'author_id'), id=post_id)
+    if post.author_id == request.user.id:
+        if _wants_json(request):
+            return JsonResponse({'error': "Нельзя добавить в избранное свой пост"}, status=400)
         messages.error(request, "Нельзя добавить в избранное свой пост")
         next_url = request.META.get("HTTP_REFERER", reverse("home"))
         return HttpResponseRedirect(next_url)
-    favorite_obj, created = Favorite.objects.get_or_create(user=request.user, post=post)
-    if created:
-        action = "добвален в избранное"
-    else:
-        favorite_obj.delete()
-        action = "удалён из избранного"
-
-    messages.info(request, f'Пост {post.title} был {action}')
-    next_url = request.META.get('HTTP_REFERER', reverse('home'))
-    return HttpResponseRedirect(next_url)
+    return _reaction_response(request, post, 'favorite', lambda active: (
+        f"Пост {post.title} был {'добвален в избранное' if active else 'удалён из избранного'}"))
 
 @login_required
 def messages_list(request, recipient_id=None):
-    send_by_me = Message.objects.filter(sender=request.user).values_list("recipient_id", flat=True)
-    send_to_me = Message.objects.filter(recipient=request.user).values_list("sender_id", flat=True)
-    all_contact_ids = set(list(send_by_me) + list(send_to_me))
-    contacts = User.objects.filter(id__in=all_contact_ids).select_related("profile").distinct()
-    contacts_with_unread = []
-    for contact in contacts:
-        unread_count = Message.objects.filter(
-            sender=contact,
-            recipient=request.user,
-            is_read=False,
-        ).count()
-        contacts_with_unread.append({
-            'contact': contact,
-            'unread_count': unread_count,
-        })
-    def get_last_message_time(contact):
-        last_message = Message.objects.filter(
-            (Q(sender=request.user) & Q(recipient=contact)) |
-            (Q(sender=contact) & Q(recipient=request.user))
-        ).order_by('-timestamp').first()
-        return last_message.timestamp if last_message else None
-
-    sorted_contacts_with_unread = sorted(contacts_with_unread, key=lambda x: get_last_message_time(x["contact"]), reverse=True)
+    # Список диалогов - одна выборка из сводной таблицы, отсортированная по последней активности
+    paginator = Paginator(inbox_queryset(request.user), CONVERSATIONS_PER_PAGE)
+    conversations = paginator.get_page(request.GET.get('page'))
+
     selected_conversation = None
     selected_recipient = None
+    has_older = False
+    contact_last_read = 0
     if recipient_id:
         selected_recipient = get_object_or_404(User, id=recipient_id)
-        if selected_recipient.id in all_contact_ids:
-            Message.objects.filter(recipient=request.user, sender=selected_recipient, is_read=False).update(is_read=True)
-            selected_conversation = Message.objects.filter(
-                (Q(sender=request.user) & Q(recipient=selected_recipient)) |
-                (Q(sender=selected_recipient) & Q(recipient=request.user))
-            ).select_related('sender__profile').order_by('timestamp')
+        if Conversation.objects.filter(user=request.user, contact=selected_recipient).exists():
+            mark_conversation_read(request.user, selected_recipient)
+            # Только последние сообщения; более ранние подгружаются по кнопке
+            selected_conversation, has_older = conversation_page(request.user, selected_recipient)
+            # Отметки "прочитано" у своих сообщений
+            contact_last_read = read_receipt(request.user, selected_recipient)
 
-    unread_count_total = Message.objects.filter(recipient=request.user, is_read=False).count()
+    unread_count_total = get_unread_count(request.user)
 
     context = {
-        'contacts_with_unread': sorted_contacts_with_unread,
+        'conversations': conversations,
         'selected_conversation': selected_conversation,
         'selected_recipient': selected_recipient,
+        'has_older': has_older,
+        'contact_last_read': contact_last_read,
         'unread_count_total': unread_count_total,
     }
 
     return render(request, "app/messages_list.html", context)
 
+# Порция переписки в компактном JSON: ?before=<id> - более ранние сообщения,
+# ?since=<id> - пришедшие после указанного
+@login_required
+def conversation_messages(request, recipient_id):
+    contact = get_object_or_404(User, id=recipient_id)
+    before = request.GET.get('before', '')
+    since = request.GET.get('since', '')
+    if since.isdigit():
+        items, has_more = messages_since(request.user, contact, int(since))
+    elif before.isdigit():
+        items, has_more = conversation_page(request.user, contact, before=int(before))
+    else:
+        return HttpResponseBadRequest("Нужен параметр before или since")
+
+    return JsonResponse({'messages': [message_json(message) for message in items], 'has_more': has_more})
+
+# Прочтение переписки до сообщения up_to (по умолчанию - до последнего): сдвигается водяной знак
+@login_required
+@require_POST
+def mark_messages_read(request, recipient_id):
+    contact = get_object_or_404(User, id=recipient_id)
+    up_to = request.POST.get('up_to', '')
+    if up_to and not up_to.isdigit():
+        return HttpResponseBadRequest("Некорректный id сообщения")
+    last_read_id = mark_conversation_read(request.user, contact, up_to=int(up_to) if up_to else None)
+    return JsonResponse({'last_read_id': last_read_id, 'unread': get_unread_count(request.user)})
+
+# Прочитать все переписки разом
+@login_required
+@require_POST
+def mark_all_messages_read(request):
+    conversations = mark_all_read(request.user)
+    return JsonResponse({'conversations': conversations, 'unread': get_unread_count(request.user)})
+
+# Отметка о прочтении: до какого сообщения собеседник прочитал переписку
+@login_required
+def read_receipts(request, recipient_id):
+    contact = get_object_or_404(User, id=recipient_id)
+    return JsonResponse({'last_read_id': read_receipt(request.user, contact)})
+
+# Поток событий обслуживает ASGI-приложение (BLOG/asgi.py). Сюда запрос доходит только
+# без него, например под runserver: 204 говорит EventSource не переподключаться
+def message_stream(request):
+    return HttpResponse(status=204)
+
 @login_required
 def send_message(request, recipient_id):
     recipient = get_object_or_404(User, id=recipient_id)
@@ -294,7 +468,8 @@ def send_message(request, recipient_id):
             message = form.save(commit=False)
             message.sender = request.user
             message.recipient = recipient
-            message.save()
+            with transaction.atomic():
+                message.save()
             messages.success(request, f"Сообщение успешно отправленно, кому:{recipient.username}")
             return redirect('messages_list', recipient_id=recipient.id)
     else:
@@ -310,32 +485,88 @@ def send_message(request, recipient_id):
 
     return render(request, 'app/send_message.html', context)
 
+# Страница каталога по GET-параметрам: фильтры, сортировка, курсор.
+# Некорректные значения фильтров просто не применяются
+def _catalog_page(request, category=None):
+    form = CatalogFilterForm(request.GET)
+    form.is_valid()
+    filters = form.cleaned_data
+    page = get_catalog_page(sort=filters.get('sort') or 'new', cursor=request.GET.get('cursor'), category=category,
+                            min_price=filters.get('min_price'), max_price=filters.get('max_price'))
+    next_url = None
+    if page.has_next:
+        params = request.GET.copy()
+        params['cursor'] = page.next_cursor
+        next_url = f"?{params.urlencode()}"
+    return form, page, next_url
+
+@cache_shop_page
 def shop_home(request):
-    products = Product.objects.select_related('category').all()
+    try:
+        form, page, next_url = _catalog_page(request)
+    except InvalidCursor:
+        return HttpResponseBadRequest("Некорректный курсор")
+    # Запрос категорий выполнится только при промахе кеша фрагмента в шаблоне
     categories = Category.objects.all()
 
     context = {
-        "products": products,
+        "products": page.items,
+        "next_url": next_url,
+        "filter_form": form,
         "categories": categories,
+        "shop_version": get_shop_version(),
     }
 
     return render(request, "app/shop/home.html", context)
 
+@cache_shop_page
 def shop_category(request, category_id):
     category = get_object_or_404(Category, id=category_id)
-    products = Product.objects.filter(category=category).select_related("category")
+    try:
+        form, page, next_url = _catalog_page(request, category=category)
+    except InvalidCursor:
+        return HttpResponseBadRequest("Некорректный курсор")
     categories = Category.objects.all()
 
     context = {
-        "products": products,
+        "products": page.items,
+        "next_url": next_url,
+        "filter_form": form,
         "category": category,
         "categories": categories,
+        "shop_version": get_shop_version(),
     }
 
     return render(request, 'app/shop/category.html', context)
 
+# Каталог в JSON: те же фильтры, плюс category=<id>
+@cache_shop_page
+def shop_catalog_api(request):
+    category = request.GET.get('category')
+    if category is not None and not category.isdigit():
+        return HttpResponseBadRequest("Некорректная категория")
+    try:
+        form, page, next_url = _catalog_page(request, category=int(category) if category else None)
+    except InvalidCursor:
+        return HttpResponseBadRequest("Некорректный курсор")
+
+    items = []
+    for product in page.items:
+        image = product.primary_image
+        items.append({
+            'id': product.id,
+            'name': product.name,
+            'price': str(product.price),
+            'category': product.category.name,
+            'url': reverse('shop_product_detail', args=[product.id]),
+            'image': thumbnail_url(image, (300, 300)) if image else None,
+        })
+    return JsonResponse({'products': items, 'next_cursor': page.next_cursor})
+
+@cache_shop_page
 def shop_product_detail(request, product_id):
-    product = get_object_or_404(Product, id=product_id)
+    product = get_object_or_404(Product.objects.select_related('category').prefetch_related(primary_image_prefetch()),
+                                id=product_id)
 
     context = {
         "product": product,
@@ -343,39 +574,53 @@ def shop_product_detail(request, product_id):
 
     return render(request, "app/shop/product_detail.html", context)
 
-def shop_checkout(request, product_id):
-    product = get_object_or_404(Product, id=product_id)
-    if request.method == "POST":
-        quantity = int(request.POST.get('quantity', 1))
-        total_price = product.price * quantity
-        order = Order.objects.create(
-            user = request.user,
-            product = product,
-            quantity = quantity,
-            total_price = total_price,
-        )
-
-
-        paymant = yookassa.Payment.create({
-            "amount": {
-                "value": str(total_price),
-                "current": "RUB",
-            },
-            "confirmation": {
-                "type": "redirect",
-                "return_url": request.build_absolute_uri("/shop/success"),
-            },
-            "capture": True,
-            "description": f"Покупка {product.name}",
-            "metadata": {
-                "order_id": order.id,
-            },
-        })
-
-        order.yookassa_payment_id = paymant.id
-        order.save()
-        return redirect(paymant.confirmation.confirmation_uri)
-    return redirect("shop_product_detail", product_id=product_id)
+# Асинхронное представление: пока ждём ЮKassa, поток воркера свободен (нужен запуск через ASGI)
+@require_POST
+async def shop_checkout(request, product_id):
+    user = await request.auser()
+    if not user.is_authenticated:
+        return redirect('login')
+    product = await aget_object_or_404(Product, id=product_id)
+    try:
+        quantity = max(int(request.POST.get('quantity', 1)), 1)
+    except ValueError:
+        quantity = 1
+
+    order = await Order.objects.acreate(
+        user=user,
+        product=product,
+        quantity=quantity,
+        total_price=product.price * quantity,
+    )
+    try:
+        payment = await create_payment(order, product, request.build_absolute_uri(reverse('shop_success')))
+    except PaymentError:
+        await Order.objects.filter(pk=order.pk).aupdate(status='cancelled')
+        messages.error(request, "Платёжный сервис недоступен, попробуйте позже")
+        return redirect('shop_product_detail', product_id=product_id)
+
+    await Order.objects.filter(pk=order.pk).aupdate(yookassa_payment_id=payment['id'])
+    return redirect(payment['confirmation']['confirmation_url'])
+
+# Уведомления ЮKassa. Тело уведомления не подписано, поэтому статус берётся не из него,
+# а из повторного запроса платежа к API; повторная доставка ничего не меняет
+@csrf_exempt
+@require_POST
+async def yookassa_webhook(request):
+    try:
+        payment_id = json.loads(request.body)['object']['id']
+    except (ValueError, KeyError, TypeError):
+        return HttpResponseBadRequest("Некорректное уведомление")
+    # Тело уведомления ничем не подписано, а id уходит в путь запроса к API
+    if not is_payment_id(payment_id):
+        return HttpResponseBadRequest("Некорректное уведомление")
+    try:
+        payment = await get_payment(payment_id)
+    except PaymentError:
+        # Не 200 - ЮKassa повторит доставку позже
+        return HttpResponse(status=502)
+    await apply_payment(payment)
+    return HttpResponse(status=200)
 
 def shop_success(request):
     return render(request, "app/shop/success.html")
\ No newline at end of file